@@ -11,8 +11,39 @@
 # In[10]:
 
 
+import asyncio
+import csv
+import hashlib
+import json
+import os
+import platform
+import random
 import sqlite3
+import sys
+import threading
+import time
+import tracemalloc
+import zlib
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
 from datetime import datetime, date, timedelta
+from functools import lru_cache, wraps
+from itertools import chain, islice
+from pathlib import Path
+
+import numpy as np
+
+# This is the SQLite database that every function reads from and writes to unless it is handed a different session.
+# It can be set with the LYFTER_DB_PATH environment variable or with set_database_path.
+
+DATABASE_PATH = os.environ.get('LYFTER_DB_PATH','LiftAppTest42.db')
+
+# Workout data belongs to a user. Sessions act for this user unless they are opened for another one (see "for_user"),
+# and data from before users existed belongs to it.
+
+DEFAULT_USER_ID = 1
 
 # This is the muscle set dictionary that will be utilized every time workout data is input, whether it be a single
 # session, or multiple workouts input at once. Python will receive the workout data, convert it into a nested dict,
@@ -26,6 +57,8 @@ muscle_sets = {'Lats':0, 'Lower_Back':0,'Trapezius':0,
                'Glutes':0, 'Hamstrings':0, 'Quadriceps':0, 'Calves':0,
                'Neck':0}
 
+muscle_names = tuple(muscle_sets)
+
 # This is the exercise list dictionary that functions reference in order to determine what muscles were being worked
 # by which exercise. Based on whether the muscle is a primary, secondary, or tertiary mover, the number of sets
 # completed per muscle will be adjusted accordingly by a "mover constant."
@@ -80,6 +113,836 @@ exercise_list = {
      'French Press': {'Triceps':1}
 }
 
+# Returns the ISO (year, week number) of a YYYY-MM-DD date. The same dates come up over and over again within a batch
+# of sets, so the parsed result is cached.
+
+@lru_cache(maxsize=8192)
+def iso_week_of_date(date):
+    iso_year, iso_week, iso_weekday = datetime.strptime(date,'%Y-%m-%d').isocalendar()
+    return iso_year, iso_week
+
+# Conversions between YYYY-MM-DD dates and day ordinals, cached for the same reason.
+
+@lru_cache(maxsize=8192)
+def ordinal_of_date(date):
+    return datetime.strptime(date,'%Y-%m-%d').toordinal()
+
+@lru_cache(maxsize=8192)
+def date_of_ordinal(ordinal):
+    return date.fromordinal(ordinal).isoformat()
+
+# Weeks of different years are told apart by a single integer key, iso_year * 100 + iso_week (e.g. 202112 for week 12
+# of 2021), so the muscle set engine can group any number of years of weeks at once.
+
+def week_key(iso_year,iso_week):
+    return iso_year*100 + iso_week
+
+# Tonnage (reps x weight) and estimated one rep max of a single set. The 1RM uses the Epley formula,
+# weight x (1 + reps / 30), except that a single is its own 1RM. "estimated_1rm_sql" is the same formula over the
+# Reps and Weight columns of WorkoutTable.
+
+def set_tonnage(reps,weight):
+    return 0.0 if reps is None or weight is None else reps*weight
+
+def estimated_1rm(reps,weight):
+    if reps is None or weight is None:
+        return None
+    return weight if reps == 1 else weight*(1 + reps/30)
+
+estimated_1rm_sql = 'CASE WHEN Reps = 1 THEN Weight ELSE Weight*(1 + Reps/30.0) END'
+
+
+# Opt-in instrumentation of SQL and of the muscle set computations. While "instrumentation" is None (the default),
+# every instrumented path costs a single comparison. enable_instrumentation() installs an Instrumentation that
+# records, per call site (the function and line that called session.execute or executemany), the number of
+# statements, rows affected and every duration, for cumulative and percentile timings; the number and duration of
+# commits and rollbacks; the duration of the functions decorated with "instrumented"; and a log of statements slower
+# than "slow_query_ms", with their EXPLAIN QUERY PLAN. Commits are counted, not fsyncs: with WAL and
+# synchronous=NORMAL, SQLite only syncs at checkpoints, which Python cannot observe.
+
+instrumentation = None
+
+class Instrumentation:
+    def __init__(self, slow_query_ms=50.0, slow_query_log_size=100):
+        self.slow_query_ms = slow_query_ms
+        self.slow_query_log_size = slow_query_log_size
+        self.lock = threading.Lock()
+        self.call_sites = {}
+        self.functions = {}
+        self.commits, self.rollbacks = array('d'), array('d')
+        self.slow_queries = []
+
+    def execute(self, conn, sql_statement, parameters, many=False):
+        caller = sys._getframe(2)
+        if many:
+            parameter_rows = iter(parameters)
+            first_parameters = next(parameter_rows,None)
+            parameters = parameter_rows if first_parameters is None else chain([first_parameters],parameter_rows)
+        started = time.perf_counter()
+        cursor = (conn.executemany if many else conn.execute)(sql_statement,parameters)
+        seconds = time.perf_counter() - started
+        call_site = f'{caller.f_code.co_name}:{caller.f_lineno}'
+        with self.lock:
+            statistics = self.call_sites.get(call_site)
+            if statistics is None:
+                statistics = self.call_sites[call_site] = {'statement':' '.join(sql_statement.split())[:200],
+                                                           'rows':0,'seconds':array('d')}
+            statistics['seconds'].append(seconds)
+            statistics['rows'] += max(cursor.rowcount,0)
+        if seconds*1000 >= self.slow_query_ms:
+            self.log_slow_query(conn,call_site,sql_statement,first_parameters if many else parameters,seconds)
+        return cursor
+
+    def log_slow_query(self, conn, call_site, sql_statement, parameters, seconds):
+        try:
+            query_plan = [row[-1] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql_statement}',
+                                                          () if parameters is None else parameters)]
+        except sqlite3.Error:
+            query_plan = None
+        with self.lock:
+            self.slow_queries.append({'call_site':call_site,'statement':' '.join(sql_statement.split()),
+                                      'milliseconds':seconds*1000,'query_plan':query_plan})
+            del self.slow_queries[:-self.slow_query_log_size]
+
+    def record_transaction_end(self, seconds, committed):
+        with self.lock:
+            (self.commits if committed else self.rollbacks).append(seconds)
+
+    def record_call(self, name, seconds):
+        with self.lock:
+            self.functions.setdefault(name,array('d')).append(seconds)
+
+    def report(self):
+        def timings(seconds):
+            milliseconds = np.asarray(seconds)*1000 if len(seconds) else np.zeros(1)
+            return {'count':len(seconds),'total_ms':float(milliseconds.sum()) if len(seconds) else 0.0,
+                    'p50_ms':float(np.percentile(milliseconds,50)),'p99_ms':float(np.percentile(milliseconds,99))}
+        with self.lock:
+            return {'call_sites':{call_site:dict(timings(statistics['seconds']),rows=statistics['rows'],
+                                                 statement=statistics['statement'])
+                                  for call_site,statistics in self.call_sites.items()},
+                    'functions':{name:timings(seconds) for name,seconds in self.functions.items()},
+                    'commits':timings(self.commits),
+                    'rollbacks':timings(self.rollbacks),
+                    'date_caches':{function.__name__:function.cache_info()._asdict()
+                                   for function in (iso_week_of_date,ordinal_of_date,date_of_ordinal)},
+                    'slow_queries':list(self.slow_queries)}
+
+    def to_json(self, path=None):
+        report_json = json.dumps(self.report(),indent=2)
+        if path is not None:
+            with open(path,'w') as file:
+                file.write(report_json)
+        return report_json
+
+    # Text summary with the call sites and functions that took the most time first.
+    def summary(self, top=20):
+        report = self.report()
+        lines = [f"{'call site':40} {'count':>8} {'rows':>9} {'total ms':>10} {'p50 ms':>8} {'p99 ms':>8}  statement"]
+        for call_site,statistics in sorted(report['call_sites'].items(),key=lambda item: -item[1]['total_ms'])[:top]:
+            lines.append(f"{call_site:40} {statistics['count']:8d} {statistics['rows']:9d} {statistics['total_ms']:10.2f} "
+                         f"{statistics['p50_ms']:8.3f} {statistics['p99_ms']:8.3f}  {statistics['statement'][:60]}")
+        for name,statistics in sorted(report['functions'].items(),key=lambda item: -item[1]['total_ms']):
+            lines.append(f"{name:40} {statistics['count']:8d} {'':9} {statistics['total_ms']:10.2f} "
+                         f"{statistics['p50_ms']:8.3f} {statistics['p99_ms']:8.3f}")
+        for name in ('commits','rollbacks'):
+            statistics = report[name]
+            lines.append(f"{name:40} {statistics['count']:8d} {'':9} {statistics['total_ms']:10.2f} "
+                         f"{statistics['p50_ms']:8.3f} {statistics['p99_ms']:8.3f}")
+        for name,cache_info in report['date_caches'].items():
+            lines.append(f"{name} cache: {cache_info['hits']} hits, {cache_info['misses']} misses")
+        lines.append(f"{len(report['slow_queries'])} queries slower than {self.slow_query_ms} ms")
+        for slow_query in report['slow_queries'][-top:]:
+            lines.append(f"  {slow_query['milliseconds']:.1f} ms at {slow_query['call_site']}: {slow_query['statement'][:100]}")
+            lines.extend(f'    {step}' for step in slow_query['query_plan'] or ())
+        return '\n'.join(lines)
+
+def enable_instrumentation(slow_query_ms=50.0):
+    global instrumentation
+    instrumentation = Instrumentation(slow_query_ms)
+    return instrumentation
+
+def disable_instrumentation():
+    global instrumentation
+    last_instrumentation, instrumentation = instrumentation, None
+    return last_instrumentation
+
+# Decorator timing a function while instrumentation is enabled.
+
+def instrumented(name):
+    def decorate(function):
+        @wraps(function)
+        def instrumented_function(*args, **kwargs):
+            if instrumentation is None:
+                return function(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                if instrumentation is not None:
+                    instrumentation.record_call(name,time.perf_counter() - started)
+        return instrumented_function
+    return decorate
+
+
+# Mover constants used to weigh the sets of an exercise for primary (1), secondary (2) and tertiary (3) movers.
+
+mover_constants = {1:1.0, 2:2/3, 3:1/3}
+
+
+# The muscle set engine compiles an exercise catalog into a dense coefficient matrix with one row per exercise ID and
+# one column per muscle, holding the mover coefficient of that muscle for that exercise. Muscle sets for any number
+# of weeks are then a single matrix product: (weeks x exercises set counts) @ (exercises x muscles coefficients).
+# Exercise IDs are the ExerciseID of the Exercise table; row 0 is never used. "muscle_ids" holds the MuscleID of the
+# Muscle table for every column.
+
+class MuscleSetEngine:
+    def __init__(self, exercise_coefficients, exercise_ids=None, muscle_names=muscle_names, muscle_ids=None):
+        if exercise_ids is None:
+            exercise_ids = {exercise:exercise_id for exercise_id,exercise in enumerate(exercise_coefficients,start=1)}
+        self.muscle_names = tuple(muscle_names)
+        self.muscle_ids = tuple(range(1,len(self.muscle_names) + 1) if muscle_ids is None else muscle_ids)
+        self.exercise_ids = dict(exercise_ids)
+        self.exercise_names = [None]*(max(self.exercise_ids.values(),default=0) + 1)
+        for exercise,exercise_id in self.exercise_ids.items():
+            self.exercise_names[exercise_id] = exercise
+        self.exercise_names = tuple(self.exercise_names)
+        muscle_columns = {muscle:column for column,muscle in enumerate(self.muscle_names)}
+        
+        self.coefficients = np.zeros((len(self.exercise_names),len(self.muscle_names)))
+        for exercise,muscle_coefficients in exercise_coefficients.items():
+            for muscle,coefficient in muscle_coefficients.items():
+                self.coefficients[self.exercise_ids[exercise],muscle_columns[muscle]] = coefficient
+
+    # Builds an engine from the Exercise, Muscle and ExerciseMover tables of a database.
+    @classmethod
+    def from_database(cls, session):
+        exercise_ids = dict(session.execute('SELECT Name,ExerciseID FROM Exercise;').fetchall())
+        exercise_coefficients = {exercise:{} for exercise in exercise_ids}
+        for exercise,muscle,coefficient in session.execute('''SELECT Exercise.Name,Muscle.Name,Coefficient 
+                                                               FROM ExerciseMover 
+                                                               JOIN Exercise USING (ExerciseID) 
+                                                               JOIN Muscle USING (MuscleID);'''):
+            exercise_coefficients[exercise][muscle] = coefficient
+        muscle_ids = dict(session.execute('SELECT Name,MuscleID FROM Muscle;').fetchall())
+        return cls(exercise_coefficients,exercise_ids,muscle_ids=[muscle_ids[muscle] for muscle in muscle_names])
+
+    def lookup_exercise_ids(self, exercises):
+        try:
+            return np.fromiter((self.exercise_ids[exercise] for exercise in exercises),dtype=np.intp)
+        except KeyError as error:
+            raise ValueError(f'Unknown exercise: {error.args[0]!r}') from None
+
+    # Returns the sorted unique week ids and a (weeks x muscles) matrix of muscle sets, from parallel sequences of
+    # week ids, exercise IDs and number of sets.
+    @instrumented('MuscleSetEngine.weekly_totals')
+    def weekly_totals(self, week_ids, exercise_ids, set_counts):
+        weeks, week_index = np.unique(np.asarray(week_ids,dtype=np.int64),return_inverse=True)
+        set_count_matrix = np.zeros((len(weeks),len(self.exercise_names)))
+        np.add.at(set_count_matrix,(week_index,np.asarray(exercise_ids,dtype=np.intp)),
+                  np.asarray(set_counts,dtype=np.float64))
+        return weeks, set_count_matrix @ self.coefficients
+
+    # Same as weekly_totals, as a {week_id: muscle sets dictionary} mapping.
+    def weekly_muscle_sets(self, week_ids, exercise_ids, set_counts):
+        weeks, totals = self.weekly_totals(week_ids,exercise_ids,set_counts)
+        return {week_id:dict(zip(self.muscle_names,muscle_totals)) 
+                for week_id,muscle_totals in zip(weeks.tolist(),totals.tolist())}
+
+    # Muscle sets dictionary for a single group of exercise IDs and number of sets.
+    @instrumented('MuscleSetEngine.muscle_sets')
+    def muscle_sets(self, exercise_ids, set_counts):
+        set_count_vector = np.zeros(len(self.exercise_names))
+        np.add.at(set_count_vector,np.asarray(exercise_ids,dtype=np.intp),np.asarray(set_counts,dtype=np.float64))
+        return dict(zip(self.muscle_names,(set_count_vector @ self.coefficients).tolist()))
+
+
+# These pragmas are applied to every connection a session opens. WAL lets readers keep reading while a write commits,
+# and synchronous=NORMAL only fsyncs at WAL checkpoints instead of on every single commit.
+
+session_pragmas = {'journal_mode':'WAL',
+                   'synchronous':'NORMAL',
+                   'cache_size':-16000,
+                   'temp_store':'MEMORY'}
+
+
+# A bounded read-through cache for query results, kept per session. Entries are evicted least recently used first once
+# "max_entries" is reached and expire "ttl_seconds" after they were loaded. Keys are tuples:
+# ('week', iso_year, iso_week, kind) for per-week results and ('sets', date, exercise ID) for set lookups, where the
+# date or the exercise ID may be None for a whole workout or a whole exercise history. Writes invalidate only the
+# entries of the dates, exercises and weeks they touch (see invalidate_changes). Cached values must not be mutated.
+# A cache with max_entries=0 is disabled.
+
+class QueryCache:
+    def __init__(self, max_entries=1024, ttl_seconds=300.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.week_keys = {}
+        self.hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+
+    def get_or_load(self, key, load):
+        if not self.max_entries:
+            self.misses += 1
+            return load()
+        entry = self.entries.get(key)
+        if entry is not None:
+            value, expires_at = entry
+            if time.monotonic() < expires_at:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+            self._discard(key)
+            self.expirations += 1
+        self.misses += 1
+        value = load()
+        self.entries[key] = (value, time.monotonic() + self.ttl_seconds)
+        if key[0] == 'week':
+            self.week_keys.setdefault(key[1:3],set()).add(key)
+        while len(self.entries) > self.max_entries:
+            self._discard(next(iter(self.entries)))
+            self.evictions += 1
+        return value
+
+    def _discard(self, key):
+        if self.entries.pop(key,None) is not None and key[0] == 'week':
+            week_keys = self.week_keys[key[1:3]]
+            week_keys.discard(key)
+            if not week_keys:
+                del self.week_keys[key[1:3]]
+
+    def invalidate_week(self, iso_year, iso_week):
+        for key in list(self.week_keys.get((iso_year,iso_week),())):
+            self._discard(key)
+            self.invalidations += 1
+
+    # Drops the entries affected by a list of changes in the format taken by apply_workout_changes: the week of every
+    # changed date, and the lookups of that date, that exercise, and that exercise on that date.
+    def invalidate_changes(self, workout_changes):
+        for date,exercise_id,*change in workout_changes:
+            self.invalidate_week(*iso_week_of_date(date))
+            for key in (('sets',date,exercise_id),('sets',date,None),('sets',None,exercise_id)):
+                if key in self.entries:
+                    self._discard(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.week_keys.clear()
+
+    def stats(self):
+        return {'entries':len(self.entries),'hits':self.hits,'misses':self.misses,'evictions':self.evictions,
+                'expirations':self.expirations,'invalidations':self.invalidations}
+
+
+# A session owns one SQLite connection and is shared by every function that touches the database, instead of each
+# function running its own connect() and close(). sqlite3 keeps a cache of prepared statements per connection, so
+# statements run through the same session are only compiled once. Writes are grouped with "transaction", which can
+# be nested: only the outermost block commits, inner blocks become savepoints. Query results are cached in
+# "query_cache"; a rolled back write may already have been read into it, so rolling back clears the cache. Writes
+# committed by other connections (other sessions, threads or processes) change the database's data_version, which is
+# checked before every cached read, and the caches of the session are then cleared. A session
+# acts for DEFAULT_USER_ID; "for_user" gives a session acting for another user over the same connection. A read_only
+# session opens the database file with mode=ro, so it can never take the write lock, and leaves its journal mode as
+# it is. A session opened with
+# "in_memory" works on an in-memory copy of a database file and writes it back with write_back.
+
+class LyfterSession:
+    def __init__(self, db_path=None, pragmas=None, cached_statements=256, query_cache=None, read_only=False):
+        db_path = DATABASE_PATH if db_path is None else db_path
+        self.db_path = db_path
+        if read_only:
+            self.conn = sqlite3.connect(f'{Path(db_path).resolve().as_uri()}?mode=ro', uri=True, isolation_level=None,
+                                        cached_statements=cached_statements)
+        else:
+            self.conn = sqlite3.connect(db_path, isolation_level=None, cached_statements=cached_statements)
+        for pragma, value in (session_pragmas if pragmas is None else pragmas).items():
+            if read_only and pragma == 'journal_mode':
+                continue
+            self.conn.execute(f'PRAGMA {pragma}={value};')
+        self.transaction_depth = 0
+        self._engine = None
+        self.query_cache = QueryCache() if query_cache is None else query_cache
+        self.data_version = self.conn.execute('PRAGMA data_version;').fetchone()[0]
+        self.user_id = DEFAULT_USER_ID
+        self.user_sessions = {}
+        self.write_back_path = None
+        self.write_back_seconds = None
+
+    # Opens a session on an in-memory database loaded from the file at db_path with the backup API, so inserts,
+    # rebuilds, updates and deletes run without any disk I/O. Nothing reaches the file until write_back is called;
+    # with write_back_seconds, the first commit after that many seconds since the last write-back also writes back,
+    # and closing the session writes back whatever is left. Writing back replaces the whole file with the in-memory
+    # copy, so writes made to the file by other connections since it was loaded are lost: the in-memory session must
+    # be the file's only writer.
+    @classmethod
+    def in_memory(cls, db_path=None, write_back_seconds=None, pragmas=None, query_cache=None):
+        db_path = DATABASE_PATH if db_path is None else db_path
+        session = cls(':memory:', pragmas, query_cache=query_cache)
+        source = sqlite3.connect(db_path)
+        try:
+            source.backup(session.conn)
+        finally:
+            source.close()
+        session.write_back_path = db_path
+        session.write_back_seconds = write_back_seconds
+        session.written_back_at = time.monotonic()
+        session.written_back_changes = session.conn.total_changes
+        return session
+
+    # The muscle set engine for this database's exercise catalog, loaded on first use and kept for the session.
+    @property
+    def engine(self):
+        if self._engine is None:
+            self._engine = MuscleSetEngine.from_database(self)
+        return self._engine
+
+    def reload_exercise_catalog(self):
+        self._engine = None
+        self.clear_query_caches()
+
+    # Sessions for other users of this database are kept here, so each keeps its query cache between calls.
+    def for_user(self, user_id):
+        if user_id == self.user_id:
+            return self
+        user_session = self.user_sessions.get(user_id)
+        if user_session is None:
+            user_session = self.user_sessions[user_id] = UserSession(self, user_id)
+        return user_session
+
+    def clear_query_caches(self):
+        self.query_cache.clear()
+        for user_session in self.user_sessions.values():
+            user_session.query_cache.clear()
+
+    def check_data_version(self):
+        data_version = self.conn.execute('PRAGMA data_version;').fetchone()[0]
+        if data_version != self.data_version:
+            self.data_version = data_version
+            self.clear_query_caches()
+
+    def cached_query(self, key, load):
+        if self.query_cache.max_entries:
+            self.check_data_version()
+        return self.query_cache.get_or_load(key, load)
+
+    def execute(self, sql_statement, parameters=()):
+        if instrumentation is None:
+            return self.conn.execute(sql_statement, parameters)
+        return instrumentation.execute(self.conn, sql_statement, parameters)
+
+    def executemany(self, sql_statement, parameter_rows):
+        if instrumentation is None:
+            return self.conn.executemany(sql_statement, parameter_rows)
+        return instrumentation.execute(self.conn, sql_statement, parameter_rows, many=True)
+
+    @contextmanager
+    def transaction(self):
+        if self.transaction_depth == 0:
+            begin, commit, rollback = 'BEGIN IMMEDIATE;', ['COMMIT;'], ['ROLLBACK;']
+        else:
+            savepoint = f'lyfter_{self.transaction_depth}'
+            begin = f'SAVEPOINT {savepoint};'
+            commit = [f'RELEASE {savepoint};']
+            rollback = [f'ROLLBACK TO {savepoint};', f'RELEASE {savepoint};']
+        self.conn.execute(begin)
+        self.transaction_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self.transaction_depth -= 1
+            started = time.perf_counter()
+            for sql_statement in rollback:
+                self.conn.execute(sql_statement)
+            self.clear_query_caches()
+            if instrumentation is not None and self.transaction_depth == 0:
+                instrumentation.record_transaction_end(time.perf_counter() - started, committed=False)
+            raise
+        self.transaction_depth -= 1
+        started = time.perf_counter()
+        for sql_statement in commit:
+            self.conn.execute(sql_statement)
+        if instrumentation is not None and self.transaction_depth == 0:
+            instrumentation.record_transaction_end(time.perf_counter() - started, committed=True)
+        if (self.write_back_seconds is not None and self.transaction_depth == 0
+                and time.monotonic() - self.written_back_at >= self.write_back_seconds):
+            self.write_back()
+
+    # Copies the database to "path" (by default, the file an in-memory session was loaded from) with an online
+    # backup of "pages" pages per step. The target is only locked while a step runs, and in WAL mode its readers
+    # keep reading throughout. An in-memory session without changes since its last write-back is not copied again.
+    # The copy replaces every page of the target, including writes other connections made to it in the meantime.
+    def write_back(self, path=None, pages=1024):
+        if path is None:
+            if self.write_back_path is None or self.conn.total_changes == self.written_back_changes:
+                return
+            path = self.write_back_path
+        if self.transaction_depth:
+            raise RuntimeError('Cannot write back a database inside a transaction')
+        target = sqlite3.connect(path)
+        try:
+            self.conn.backup(target, pages=pages)
+        finally:
+            target.close()
+        if path == self.write_back_path:
+            self.written_back_at = time.monotonic()
+            self.written_back_changes = self.conn.total_changes
+
+    def close(self):
+        if self.write_back_path is not None:
+            self.write_back()
+        self.conn.close()
+
+
+# A session acting for one user, sharing the connection, transactions and exercise catalog of the session it was
+# opened from, with a query cache of its own.
+
+class UserSession:
+    def __init__(self, session, user_id):
+        self.session = session
+        self.user_id = user_id
+        self.query_cache = QueryCache(session.query_cache.max_entries,session.query_cache.ttl_seconds)
+
+    def cached_query(self, key, load):
+        if self.query_cache.max_entries:
+            self.session.check_data_version()
+        return self.query_cache.get_or_load(key, load)
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+
+# Sessions are pooled per thread and per database file: SQLite connections may not be shared between threads, but
+# every function running on the same thread reuses the same connection.
+
+_session_pool = threading.local()
+
+def get_session(db_path=None):
+    db_path = DATABASE_PATH if db_path is None else db_path
+    sessions = getattr(_session_pool, 'sessions', None)
+    if sessions is None:
+        sessions = _session_pool.sessions = {}
+    session = sessions.get(db_path)
+    if session is None:
+        session = sessions[db_path] = LyfterSession(db_path)
+    return session
+
+def close_sessions():
+    sessions = getattr(_session_pool, 'sessions', {})
+    for session in sessions.values():
+        session.close()
+    sessions.clear()
+
+# Points every function called without a session at another database file.
+
+def set_database_path(db_path):
+    global DATABASE_PATH
+    DATABASE_PATH = db_path
+
+# Loads a database file into memory and makes it this thread's pooled session for that file, so every function called
+# on this thread without a session works in memory. Closing the sessions writes the changes back, replacing the file
+# (see LyfterSession.in_memory).
+
+def use_in_memory_database(db_path=None,write_back_seconds=None):
+    db_path = DATABASE_PATH if db_path is None else db_path
+    sessions = getattr(_session_pool, 'sessions', None)
+    if sessions is None:
+        sessions = _session_pool.sessions = {}
+    if db_path in sessions:
+        sessions.pop(db_path).close()
+    session = sessions[db_path] = LyfterSession.in_memory(db_path,write_back_seconds)
+    return session
+
+
+# Users can be sharded over several database files. A user always lives in the file picked by the CRC32 hash of the
+# user ID, so every file holds a stable share of the users and writes of different users mostly go to different files.
+# Without shard paths, every user lives in DATABASE_PATH.
+
+def shard_path_of_user(user_id,shard_paths):
+    return shard_paths[zlib.crc32(str(user_id).encode()) % len(shard_paths)]
+
+def get_user_session(user_id,shard_paths=None):
+    db_path = shard_path_of_user(user_id,shard_paths) if shard_paths else DATABASE_PATH
+    return get_session(db_path).for_user(user_id)
+
+
+muscle_columns_schema = ', '.join(f'{muscle} REAL NOT NULL DEFAULT 0' for muscle in muscle_names)
+
+
+# Creates the tables the application works with, if they do not already exist, and brings the database up to the
+# current schema. Run this once before using a database.
+
+def create_lyfter_tables(session=None):
+    session = session or get_session()
+    with session.transaction():
+        session.execute('''CREATE TABLE IF NOT EXISTS WorkoutTable (Date TEXT NOT NULL,
+                                                                     Exercise TEXT NOT NULL,
+                                                                     SetNumber INTEGER NOT NULL,
+                                                                     Reps INTEGER,
+                                                                     Weight REAL);''')
+        session.execute(f'''CREATE TABLE IF NOT EXISTS WeeklyMuscleSets (WeekID INTEGER PRIMARY KEY, 
+                                                                          {muscle_columns_schema});''')
+        migrate_lyfter_database(session)
+
+
+# Same as create_lyfter_tables, for every database file users are sharded over.
+
+def create_sharded_lyfter_tables(shard_paths):
+    for shard_path in shard_paths:
+        create_lyfter_tables(get_session(shard_path))
+
+
+# Schema migration 1: WeeklyMuscleSets is keyed by (IsoYear, WeekID), so the same week number in different years no
+# longer collides. WorkoutTable stores the ISO year and week of every set, so readers never parse dates, and gets
+# covering indexes for the date range, exercise history and per-week lookups.
+
+def migrate_to_multi_year_weeks(session):
+    session.execute('ALTER TABLE WorkoutTable ADD COLUMN IsoYear INTEGER;')
+    session.execute('ALTER TABLE WorkoutTable ADD COLUMN IsoWeek INTEGER;')
+    session.execute('CREATE INDEX IF NOT EXISTS WorkoutTableDateIndex ON WorkoutTable (Date, Exercise, SetNumber);')
+    session.execute('CREATE INDEX IF NOT EXISTS WorkoutTableExerciseIndex ON WorkoutTable (Exercise, Date);')
+    session.execute('CREATE INDEX IF NOT EXISTS WorkoutTableWeekIndex ON WorkoutTable (IsoYear, IsoWeek, Exercise);')
+    
+    dates = [row[0] for row in session.execute('SELECT DISTINCT Date FROM WorkoutTable;')]
+    session.executemany('UPDATE WorkoutTable SET IsoYear=(?), IsoWeek=(?) WHERE Date=(?);',
+                        (iso_week_of_date(date) + (date,) for date in dates))
+    
+    session.execute('DROP TABLE WeeklyMuscleSets;')
+    session.execute(f'''CREATE TABLE WeeklyMuscleSets (IsoYear INTEGER NOT NULL, 
+                                                        WeekID INTEGER NOT NULL, 
+                                                        {muscle_columns_schema}, 
+                                                        PRIMARY KEY (IsoYear, WeekID));''')
+
+
+# Schema migration 2: bulk imports record how many records of each source file have been committed, so an
+# interrupted import can resume where it stopped.
+
+def migrate_add_import_checkpoints(session):
+    session.execute('''CREATE TABLE IF NOT EXISTS ImportCheckpoint (Source TEXT PRIMARY KEY,
+                                                                     RecordsDone INTEGER NOT NULL);''')
+
+
+# Schema migration 3: exercises move into an Exercise table with integer IDs and an ExerciseMover table holding the
+# coefficient of every muscle an exercise works, seeded from "exercise_list". WorkoutTable stores the ExerciseID
+# instead of the exercise name. Exercise names in WorkoutTable that are not in "exercise_list" are kept in the
+# catalog without movers.
+
+def migrate_to_exercise_catalog(session):
+    session.execute('CREATE TABLE Muscle (MuscleID INTEGER PRIMARY KEY, Name TEXT NOT NULL UNIQUE);')
+    session.execute('CREATE TABLE Exercise (ExerciseID INTEGER PRIMARY KEY, Name TEXT NOT NULL UNIQUE);')
+    session.execute('''CREATE TABLE ExerciseMover (ExerciseID INTEGER NOT NULL REFERENCES Exercise (ExerciseID),
+                                                    MuscleID INTEGER NOT NULL REFERENCES Muscle (MuscleID),
+                                                    Coefficient REAL NOT NULL,
+                                                    PRIMARY KEY (ExerciseID, MuscleID)) WITHOUT ROWID;''')
+    for exercise,muscle_groups in exercise_list.items():
+        add_exercise(exercise,muscle_groups,session)
+    session.execute('INSERT OR IGNORE INTO Exercise (Name) SELECT DISTINCT Exercise FROM WorkoutTable;')
+    
+    session.execute('''CREATE TABLE WorkoutTableByExerciseID (Date TEXT NOT NULL,
+                                                               ExerciseID INTEGER NOT NULL REFERENCES Exercise (ExerciseID),
+                                                               SetNumber INTEGER NOT NULL,
+                                                               Reps INTEGER,
+                                                               Weight REAL,
+                                                               IsoYear INTEGER,
+                                                               IsoWeek INTEGER);''')
+    session.execute('''INSERT INTO WorkoutTableByExerciseID 
+                       SELECT Date,ExerciseID,SetNumber,Reps,Weight,IsoYear,IsoWeek 
+                       FROM WorkoutTable JOIN Exercise ON Exercise.Name = WorkoutTable.Exercise 
+                       ORDER BY WorkoutTable.rowid;''')
+    session.execute('DROP TABLE WorkoutTable;')
+    session.execute('ALTER TABLE WorkoutTableByExerciseID RENAME TO WorkoutTable;')
+    session.execute('CREATE INDEX WorkoutTableDateIndex ON WorkoutTable (Date, ExerciseID, SetNumber);')
+    session.execute('CREATE INDEX WorkoutTableExerciseIndex ON WorkoutTable (ExerciseID, Date);')
+    session.execute('CREATE INDEX WorkoutTableWeekIndex ON WorkoutTable (IsoYear, IsoWeek, ExerciseID);')
+    session.reload_exercise_catalog()
+
+
+# Adds an exercise to the catalog of a database, or replaces its movers, without touching the code. "muscle_groups"
+# uses the mover constants of "exercise_list", e.g. {'Quadriceps': 1, 'Glutes': 2}.
+
+def add_exercise(exercise,muscle_groups,session=None):
+    session = session or get_session()
+    unknown_muscles = set(muscle_groups) - set(muscle_names)
+    if unknown_muscles:
+        raise ValueError(f'Unknown muscles: {sorted(unknown_muscles)}')
+    
+    with session.transaction():
+        session.executemany('INSERT OR IGNORE INTO Muscle (MuscleID, Name) VALUES (?, ?);',
+                            enumerate(muscle_names,start=1))
+        session.execute('INSERT OR IGNORE INTO Exercise (Name) VALUES (?);',(exercise,))
+        exercise_id = session.execute('SELECT ExerciseID FROM Exercise WHERE Name=(?);',(exercise,)).fetchone()[0]
+        session.execute('DELETE FROM ExerciseMover WHERE ExerciseID=(?);',(exercise_id,))
+        session.executemany('''INSERT INTO ExerciseMover (ExerciseID, MuscleID, Coefficient) 
+                               SELECT ?, MuscleID, ? FROM Muscle WHERE Name=(?);''',
+                            ((exercise_id,mover_constants[mover_var],muscle) 
+                             for muscle,mover_var in muscle_groups.items()))
+    session.reload_exercise_catalog()
+    return exercise_id
+
+
+# Schema migration 4: rollup tables for progress charts. DailyExerciseVolume holds the number of sets, tonnage and
+# best-set estimated 1RM of every exercise on every day and WeeklyExerciseVolume the number of sets and tonnage of
+# every exercise per ISO week. DailyMuscleVolume and WeeklyMuscleVolume hold the tonnage of every muscle, weighted by
+# the mover coefficients. All of them are keyed by exercise or muscle first, so a chart reads one contiguous range.
+
+def migrate_add_volume_rollups(session):
+    session.execute('''CREATE TABLE DailyExerciseVolume (ExerciseID INTEGER NOT NULL REFERENCES Exercise (ExerciseID),
+                                                          Date TEXT NOT NULL,
+                                                          NumberOfSets INTEGER NOT NULL,
+                                                          Tonnage REAL NOT NULL,
+                                                          BestEstimated1RM REAL,
+                                                          PRIMARY KEY (ExerciseID, Date)) WITHOUT ROWID;''')
+    session.execute('''CREATE TABLE WeeklyExerciseVolume (ExerciseID INTEGER NOT NULL REFERENCES Exercise (ExerciseID),
+                                                           IsoYear INTEGER NOT NULL,
+                                                           IsoWeek INTEGER NOT NULL,
+                                                           NumberOfSets INTEGER NOT NULL,
+                                                           Tonnage REAL NOT NULL,
+                                                           PRIMARY KEY (ExerciseID, IsoYear, IsoWeek)) WITHOUT ROWID;''')
+    session.execute('''CREATE TABLE DailyMuscleVolume (MuscleID INTEGER NOT NULL REFERENCES Muscle (MuscleID),
+                                                        Date TEXT NOT NULL,
+                                                        Tonnage REAL NOT NULL,
+                                                        PRIMARY KEY (MuscleID, Date)) WITHOUT ROWID;''')
+    session.execute('''CREATE TABLE WeeklyMuscleVolume (MuscleID INTEGER NOT NULL REFERENCES Muscle (MuscleID),
+                                                         IsoYear INTEGER NOT NULL,
+                                                         IsoWeek INTEGER NOT NULL,
+                                                         Tonnage REAL NOT NULL,
+                                                         PRIMARY KEY (MuscleID, IsoYear, IsoWeek)) WITHOUT ROWID;''')
+
+
+# Schema migration 5: workout data belongs to a user. WorkoutTable and ImportCheckpoint get a UserID column, existing
+# rows belonging to DEFAULT_USER_ID, and the indexes of WorkoutTable as well as the primary keys of WeeklyMuscleSets
+# and the volume rollups lead with UserID, so the queries of one user only read that user's part of every index. The
+# derived tables are recreated empty and rebuilt after migrating.
+
+def migrate_to_multiple_users(session):
+    session.execute(f'ALTER TABLE WorkoutTable ADD COLUMN UserID INTEGER NOT NULL DEFAULT {DEFAULT_USER_ID};')
+    for index in ('WorkoutTableDateIndex','WorkoutTableExerciseIndex','WorkoutTableWeekIndex'):
+        session.execute(f'DROP INDEX {index};')
+    session.execute('CREATE INDEX WorkoutTableDateIndex ON WorkoutTable (UserID, Date, ExerciseID, SetNumber);')
+    session.execute('CREATE INDEX WorkoutTableExerciseIndex ON WorkoutTable (UserID, ExerciseID, Date);')
+    session.execute('CREATE INDEX WorkoutTableWeekIndex ON WorkoutTable (UserID, IsoYear, IsoWeek, ExerciseID);')
+    session.execute('''CREATE TABLE ImportCheckpointByUser (UserID INTEGER NOT NULL,
+                                                             Source TEXT NOT NULL,
+                                                             RecordsDone INTEGER NOT NULL,
+                                                             PRIMARY KEY (UserID, Source));''')
+    session.execute(f'''INSERT INTO ImportCheckpointByUser SELECT {DEFAULT_USER_ID},Source,RecordsDone 
+                        FROM ImportCheckpoint;''')
+    session.execute('DROP TABLE ImportCheckpoint;')
+    session.execute('ALTER TABLE ImportCheckpointByUser RENAME TO ImportCheckpoint;')
+
+    for derived_table in ('WeeklyMuscleSets','DailyExerciseVolume','WeeklyExerciseVolume','DailyMuscleVolume',
+                          'WeeklyMuscleVolume'):
+        session.execute(f'DROP TABLE {derived_table};')
+    session.execute(f'''CREATE TABLE WeeklyMuscleSets (UserID INTEGER NOT NULL,
+                                                        IsoYear INTEGER NOT NULL,
+                                                        WeekID INTEGER NOT NULL,
+                                                        {muscle_columns_schema},
+                                                        PRIMARY KEY (UserID, IsoYear, WeekID));''')
+    session.execute('''CREATE TABLE DailyExerciseVolume (UserID INTEGER NOT NULL,
+                                                          ExerciseID INTEGER NOT NULL REFERENCES Exercise (ExerciseID),
+                                                          Date TEXT NOT NULL,
+                                                          NumberOfSets INTEGER NOT NULL,
+                                                          Tonnage REAL NOT NULL,
+                                                          BestEstimated1RM REAL,
+                                                          PRIMARY KEY (UserID, ExerciseID, Date)) WITHOUT ROWID;''')
+    session.execute('''CREATE TABLE WeeklyExerciseVolume (UserID INTEGER NOT NULL,
+                                                           ExerciseID INTEGER NOT NULL REFERENCES Exercise (ExerciseID),
+                                                           IsoYear INTEGER NOT NULL,
+                                                           IsoWeek INTEGER NOT NULL,
+                                                           NumberOfSets INTEGER NOT NULL,
+                                                           Tonnage REAL NOT NULL,
+                                                           PRIMARY KEY (UserID, ExerciseID, IsoYear, IsoWeek)) WITHOUT ROWID;''')
+    session.execute('''CREATE TABLE DailyMuscleVolume (UserID INTEGER NOT NULL,
+                                                        MuscleID INTEGER NOT NULL REFERENCES Muscle (MuscleID),
+                                                        Date TEXT NOT NULL,
+                                                        Tonnage REAL NOT NULL,
+                                                        PRIMARY KEY (UserID, MuscleID, Date)) WITHOUT ROWID;''')
+    session.execute('''CREATE TABLE WeeklyMuscleVolume (UserID INTEGER NOT NULL,
+                                                         MuscleID INTEGER NOT NULL REFERENCES Muscle (MuscleID),
+                                                         IsoYear INTEGER NOT NULL,
+                                                         IsoWeek INTEGER NOT NULL,
+                                                         Tonnage REAL NOT NULL,
+                                                         PRIMARY KEY (UserID, MuscleID, IsoYear, IsoWeek)) WITHOUT ROWID;''')
+
+
+# Schema migration 6: DailyMuscleSets holds the number of sets of every muscle on every training day, weighted by the
+# mover coefficients, together with CumulativeSets, the running total of those sets up to and including that day. The
+# number of sets of any window of days is then the difference of two running totals, each read with one index seek.
+
+def migrate_add_daily_muscle_sets(session):
+    session.execute('''CREATE TABLE DailyMuscleSets (UserID INTEGER NOT NULL,
+                                                      MuscleID INTEGER NOT NULL REFERENCES Muscle (MuscleID),
+                                                      Date TEXT NOT NULL,
+                                                      Sets REAL NOT NULL,
+                                                      CumulativeSets REAL NOT NULL,
+                                                      PRIMARY KEY (UserID, MuscleID, Date)) WITHOUT ROWID;''')
+
+
+# Schema migration 7: a set is identified by (UserID, Date, ExerciseID, SetNumber), which WorkoutTableDateIndex now
+# enforces as unique, so a set can no longer be stored twice. Duplicates left by earlier re-imports are renumbered
+# first: the set written first keeps its SetNumber and the later copies are appended after the highest SetNumber of
+# their exercise on that date, in the order they were written, so no set is lost. WorkoutHash holds the content hash of every workout (the sets of one user on
+# one date) as of its last ingest; see ingest_workout_batch.
+
+def migrate_to_unique_workout_sets(session):
+    session.execute('''WITH Ranked AS (SELECT rowid AS SetRow,UserID,Date,ExerciseID,
+                                             ROW_NUMBER() OVER (PARTITION BY UserID,Date,ExerciseID,SetNumber
+                                                                ORDER BY rowid) AS Occurrence,
+                                             MAX(SetNumber) OVER (PARTITION BY UserID,Date,ExerciseID) AS LastSet
+                                      FROM WorkoutTable),
+                            Renumbered AS (SELECT SetRow,
+                                                  LastSet + ROW_NUMBER() OVER (PARTITION BY UserID,Date,ExerciseID
+                                                                               ORDER BY SetRow) AS NewSetNumber
+                                           FROM Ranked WHERE Occurrence > 1)
+                       UPDATE WorkoutTable SET SetNumber = (SELECT NewSetNumber FROM Renumbered
+                                                            WHERE SetRow = WorkoutTable.rowid)
+                       WHERE rowid IN (SELECT SetRow FROM Renumbered);''')
+    session.execute('DROP INDEX WorkoutTableDateIndex;')
+    session.execute('CREATE UNIQUE INDEX WorkoutTableDateIndex ON WorkoutTable (UserID, Date, ExerciseID, SetNumber);')
+    session.execute('''CREATE TABLE WorkoutHash (UserID INTEGER NOT NULL,
+                                                  Date TEXT NOT NULL,
+                                                  ContentHash BLOB NOT NULL,
+                                                  PRIMARY KEY (UserID, Date)) WITHOUT ROWID;''')
+
+
+# Schema migration 8: WeekFingerprint holds the fingerprint of every week of WorkoutTable as of the last time its
+# WeeklyMuscleSets row was verified; see verify_weekly_muscle_sets.
+
+def migrate_add_week_fingerprints(session):
+    session.execute('''CREATE TABLE WeekFingerprint (UserID INTEGER NOT NULL,
+                                                      IsoYear INTEGER NOT NULL,
+                                                      IsoWeek INTEGER NOT NULL,
+                                                      NumberOfSets INTEGER NOT NULL,
+                                                      Checksum INTEGER NOT NULL,
+                                                      PRIMARY KEY (UserID, IsoYear, IsoWeek)) WITHOUT ROWID;''')
+
+
+# Migrations run in order; PRAGMA user_version records how many of them a database has already been through.
+# WeeklyMuscleSets and the volume rollups only hold totals derived from WorkoutTable, so they are rebuilt once after
+# migrating.
+
+schema_migrations = [migrate_to_multi_year_weeks,
+                     migrate_add_import_checkpoints,
+                     migrate_to_exercise_catalog,
+                     migrate_add_volume_rollups,
+                     migrate_to_multiple_users,
+                     migrate_add_daily_muscle_sets,
+                     migrate_to_unique_workout_sets,
+                     migrate_add_week_fingerprints]
+
+def migrate_lyfter_database(session=None):
+    session = session or get_session()
+    schema_version = session.execute('PRAGMA user_version;').fetchone()[0]
+    if schema_version >= len(schema_migrations):
+        return
+    
+    with session.transaction():
+        for migration in schema_migrations[schema_version:]:
+            migration(session)
+        session.execute(f'PRAGMA user_version={len(schema_migrations)};')
+        update_all_weekly_muscle_sets_in_sql(session)
+        rebuild_volume_rollups(session)
+
 
 # In[11]:
 
@@ -122,296 +985,857 @@ def create_workout_data():
 # TEST create_workout_data()
 
 
-# Function that takes muscle sets dictionary and a week id and updates the WeeklyMuscleSets table in SQL.
+# Upsert statements for WeeklyMuscleSets. Each week is written with a single statement covering every muscle column,
+# and the (UserID, IsoYear, WeekID) row is created if it does not exist yet. The "add" form accumulates into the stored totals, the
+# "replace" form overwrites them.
 
-def update_weekly_muscle_sets_table_in_sql(muscle_sets,week_id):
-    conn = sqlite3.connect('LiftAppTest42.db')
-    c = conn.cursor()
-    
-    for muscle in muscle_sets.keys():# Updates SQL table with the muscle_set data for that week
-                    num_sets =  muscle_sets.get(muscle)
-                    if num_sets != 0:
-                        sql_statement = f'''UPDATE WeeklyMuscleSets 
-                                            SET {muscle} = {muscle} + (:num_sets) 
-                                            WHERE WeekID=(:week_id);'''
-                        parameters = {'num_sets':num_sets,'week_id':week_id}
-                        c.execute(sql_statement,parameters)
-                        
-    conn.commit()
-    conn.close()
-    
-    
-# Function that takes the workout dictionary created by "create_workout_data" and preps the data to be inserted into
-# the WeeklyMuscleSets table in SQL.
-
-def update_muscle_sets_in_sql_from_py(workout_dictionary):
-    conn = sqlite3.connect('LiftAppTest42.db')
-    c = conn.cursor()
-    
-    unique_weeks = []
-    
-    for date in workout_dictionary.keys():
-        week_number = int(datetime.strptime(date,'%Y-%m-%d').strftime('%V'))
-        if week_number not in unique_weeks:
-            unique_weeks.append(week_number)
-    
-    for date in workout_dictionary.keys():
-        week_number = int(datetime.strptime(date,'%Y-%m-%d').strftime('%V'))
-        for week_id in unique_weeks:
-            muscle_sets = {'Lats':0, 'Lower_Back':0,'Trapezius':0,
-               'Front_Deltoids':0, 'Side_Deltoids':0, 'Rear_Deltoids':0,
-               'Pectorals':0,
-               'Triceps':0, 'Biceps':0, 'Forearms':0,
-               'Abdominals':0,
-               'Glutes':0, 'Hamstrings':0, 'Quadriceps':0, 'Calves':0,
-               'Neck':0}
-            if week_id == week_number:
-                daily_exercise_volume = workout_dictionary.get(date)
-                for exercise,set_volume in daily_exercise_volume.items():
-                    muscle_groups = exercise_list.get(exercise)
-                    for muscle,mover_var in muscle_groups.items():
-                        if mover_var == 1:
-                            muscle_sets.update({muscle:(len(set_volume) + muscle_sets.get(muscle))})
-                        elif mover_var == 2:
-                            muscle_sets.update({muscle:(len(set_volume)*(2/3) + muscle_sets.get(muscle))})
-                        else:
-                            muscle_sets.update({muscle:(len(set_volume)*(1/3) + muscle_sets.get(muscle))})
-                            
-            update_weekly_muscle_sets_table_in_sql(muscle_sets,week_id)
-            
-            
-# Function that takes the workout dictionary created by "create_workout_data" and updates WorkoutTable in SQL.
-
-def update_workout_table_in_sql_from_py(workout_dictionary):
-    conn = sqlite3.connect('LiftAppTest42.db')
-    c = conn.cursor()
-    
-    for date in workout_dictionary.keys():
-        workout_data = []
-        workout = workout_dictionary.get(date)
-        for exercise in workout.keys():
-            working_sets = workout.get(exercise)
-            for work_set in working_sets.keys():
-                reps_weight = working_sets.get(work_set)
-                workout_data.append((date,exercise,work_set,reps_weight.get('reps'),reps_weight.get('weight')))
-
-        for element in workout_data:
-            sql_date = element[0]
-            sql_exercise = element[1]
-            sql_set_number = element[2]
-            sql_reps = element[3]
-            sql_weight = element[4]
-
-            sql_statement = '''INSERT INTO WorkoutTable 
-                                VALUES (:sql_date,
-                                        :sql_exercise,
-                                        :sql_set_number,
-                                        :sql_reps,
-                                        :sql_weight);'''
-
-            parameters = {'sql_date':sql_date,
-                          'sql_exercise':sql_exercise,
-                          'sql_set_number':sql_set_number,
-                          'sql_reps':sql_reps,
-                          'sql_weight':sql_weight}
-
-            c.execute(sql_statement,parameters)
-
-    conn.commit()
-    conn.close()
-    
-    
-# User inputs their workout(s) and updates both workout data AND weekly muscle sets in SQL.
-
-def insert_new_workout_into_sql():
-    workout_dictionary = create_workout_data()
-    
-    update_muscle_sets_in_sql_from_py(workout_dictionary)
-    
-    update_workout_table_in_sql_from_py(workout_dictionary)
+weekly_muscle_sets_columns = ', '.join(muscle_names)
+weekly_muscle_sets_values = ', '.join(f':{muscle}' for muscle in muscle_names)
 
+add_weekly_muscle_sets_statement = f'''INSERT INTO WeeklyMuscleSets (UserID, IsoYear, WeekID, {weekly_muscle_sets_columns})
+                                       VALUES (:user_id, :iso_year, :week_id, {weekly_muscle_sets_values})
+                                       ON CONFLICT (UserID, IsoYear, WeekID) DO UPDATE SET 
+                                       {', '.join(f'{muscle} = {muscle} + excluded.{muscle}' for muscle in muscle_names)};'''
 
-# In[12]:
+replace_weekly_muscle_sets_statement = f'''INSERT INTO WeeklyMuscleSets (UserID, IsoYear, WeekID, {weekly_muscle_sets_columns})
+                                           VALUES (:user_id, :iso_year, :week_id, {weekly_muscle_sets_values})
+                                           ON CONFLICT (UserID, IsoYear, WeekID) DO UPDATE SET 
+                                           {', '.join(f'{muscle} = excluded.{muscle}' for muscle in muscle_names)};'''
 
+insert_workout_set_statement = '''INSERT INTO WorkoutTable (UserID, Date, ExerciseID, SetNumber, Reps, Weight, IsoYear, IsoWeek)
+                                   VALUES (?, ?, ?, ?, ?, ?, ?, ?);'''
 
-# Updates WeeklyMuscleSets from a muscle set dictionary accquired from WorkoutTable.
 
-def update_all_weekly_muscle_sets_in_sql_from_workout_table(muscle_sets):
-    conn = sqlite3.connect('LiftAppTest42.db')
-    c = conn.cursor()
+# Turns a muscle sets dictionary, a week id, its ISO year and a user into the parameters of the WeeklyMuscleSets upsert
+# statements. The year is required: a week number alone does not say which week of which year to write.
 
-    for muscle in muscle_sets.keys():
-        num_sets =  muscle_sets.get(muscle)
-        if num_sets != 0:
-            sql_statement = f"UPDATE WeeklyMuscleSets SET {muscle} = (:num_sets) WHERE WeekID=(:week_id);"
-            parameters = {'num_sets':num_sets,'week_id':week_id}
-            c.execute(sql_statement,parameters)
-            
-    conn.commit()
-    conn.close()
-    
-# Updates ALL of the rows in WeeklyMuscleSets from data accquired from WorkoutTable.
+def weekly_muscle_sets_parameters(muscle_sets,week_id,iso_year,user_id=DEFAULT_USER_ID):
+    parameters = {muscle:muscle_sets.get(muscle,0) for muscle in muscle_names}
+    parameters['week_id'] = week_id
+    parameters['iso_year'] = iso_year
+    parameters['user_id'] = user_id
+    return parameters
 
-def update_all_weekly_muscle_sets_in_sql():
-    conn = sqlite3.connect('LiftAppTest42.db')
-    c = conn.cursor()
+# Same as weekly_muscle_sets_parameters, for every week of a {week key: muscle sets dictionary} mapping.
 
-    c.execute('SELECT Date,Exercise,COUNT(Exercise) FROM WorkoutTable GROUP BY Date,Exercise;')
-    exercise_data_sql = c.fetchall()
+def weekly_muscle_sets_parameter_rows(weekly_muscle_sets,user_id=DEFAULT_USER_ID):
+    for key,muscle_sets in weekly_muscle_sets.items():
+        iso_year, week_id = divmod(key,100)
+        yield weekly_muscle_sets_parameters(muscle_sets,week_id,iso_year,user_id)
 
 
-    date_exercise_number_of_sets = [[int(datetime.strptime(data[0],'%Y-%m-%d').strftime('%V')),
-                                 data[1],
-                                 data[2]] for data in exercise_data_sql]
+# Function that takes muscle sets dictionary, a week id and its ISO year and updates the WeeklyMuscleSets table in SQL.
 
+def update_weekly_muscle_sets_table_in_sql(muscle_sets,week_id,iso_year,session=None):
+    session = session or get_session()
+    
+    with session.transaction():
+        session.execute(add_weekly_muscle_sets_statement,
+                        weekly_muscle_sets_parameters(muscle_sets,week_id,iso_year,session.user_id))
+    
+    
+# WeeklyMuscleSets is maintained incrementally: every change to WorkoutTable is described as a list of
+# (date, exercise ID, signed number of sets) changes, and only those deltas are added to the affected weeks. A full
+# recompute from WorkoutTable is only needed for an explicit reconciliation. Changes may carry more fields after the
+# number of sets (see apply_workout_changes); they are ignored here.
+
+@instrumented('apply_weekly_muscle_set_changes')
+def apply_weekly_muscle_set_changes(set_count_changes,session=None):
+    session = session or get_session()
+
+    week_ids, exercise_ids, set_counts = [], [], []
+
+    for date,exercise_id,number_of_sets,*volume in set_count_changes:
+        if not number_of_sets:
+            continue
+        week_ids.append(week_key(*iso_week_of_date(date)))
+        exercise_ids.append(exercise_id)
+        set_counts.append(number_of_sets)
+
+    weekly_muscle_sets = session.engine.weekly_muscle_sets(week_ids,exercise_ids,set_counts)
+
+    with session.transaction():
+        session.executemany(add_weekly_muscle_sets_statement,
+                            weekly_muscle_sets_parameter_rows(weekly_muscle_sets,session.user_id))
+
+
+# Upsert statements for the volume rollup tables, adding to the stored number of sets and tonnage. The best estimated
+# 1RM of a day can only grow when sets are added; NULL means no set of that day has both reps and weight.
+
+add_daily_exercise_volume_statement = '''INSERT INTO DailyExerciseVolume (UserID, ExerciseID, Date, NumberOfSets, Tonnage, BestEstimated1RM)
+                                         VALUES (?, ?, ?, ?, ?, ?)
+                                         ON CONFLICT (UserID, ExerciseID, Date) DO UPDATE SET
+                                         NumberOfSets = NumberOfSets + excluded.NumberOfSets,
+                                         Tonnage = Tonnage + excluded.Tonnage,
+                                         BestEstimated1RM = MAX(IFNULL(BestEstimated1RM, excluded.BestEstimated1RM),
+                                                                IFNULL(excluded.BestEstimated1RM, BestEstimated1RM));'''
+
+add_weekly_exercise_volume_statement = '''INSERT INTO WeeklyExerciseVolume (UserID, ExerciseID, IsoYear, IsoWeek, NumberOfSets, Tonnage)
+                                          VALUES (?, ?, ?, ?, ?, ?)
+                                          ON CONFLICT (UserID, ExerciseID, IsoYear, IsoWeek) DO UPDATE SET
+                                          NumberOfSets = NumberOfSets + excluded.NumberOfSets,
+                                          Tonnage = Tonnage + excluded.Tonnage;'''
+
+add_daily_muscle_volume_statement = '''INSERT INTO DailyMuscleVolume (UserID, MuscleID, Date, Tonnage) VALUES (?, ?, ?, ?)
+                                       ON CONFLICT (UserID, MuscleID, Date) DO UPDATE SET Tonnage = Tonnage + excluded.Tonnage;'''
+
+add_weekly_muscle_volume_statement = '''INSERT INTO WeeklyMuscleVolume (UserID, MuscleID, IsoYear, IsoWeek, Tonnage)
+                                        VALUES (?, ?, ?, ?, ?)
+                                        ON CONFLICT (UserID, MuscleID, IsoYear, IsoWeek) DO UPDATE SET
+                                        Tonnage = Tonnage + excluded.Tonnage;'''
+
+recompute_best_estimated_1rm_statement = f'''UPDATE DailyExerciseVolume
+                                             SET BestEstimated1RM = (SELECT MAX({estimated_1rm_sql}) FROM WorkoutTable
+                                                                     WHERE UserID=(:user_id) AND Date=(:date)
+                                                                     AND ExerciseID=(:exercise_id))
+                                             WHERE UserID=(:user_id) AND ExerciseID=(:exercise_id) AND Date=(:date);'''
+
+
+# The volume rollups are maintained from the same changes as WeeklyMuscleSets, as (date, exercise ID, signed number
+# of sets, signed tonnage, best estimated 1RM of the added sets) tuples. Deleting or editing a set may lower the best
+# 1RM of its day, which cannot be derived from a delta, so with recompute_best=True the best 1RM of every changed
+# (date, exercise) is read again from the few sets of that day in WorkoutTable.
+
+@instrumented('apply_volume_changes')
+def apply_volume_changes(volume_changes,recompute_best=False,session=None):
+    session = session or get_session()
+    engine = session.engine
+    user_id = session.user_id
+
+    daily_exercise_rows = []
+    weekly_exercise_volume, daily_muscle_tonnage, weekly_muscle_tonnage = {}, {}, {}
+
+    for date,exercise_id,number_of_sets,tonnage,best_estimated_1rm in volume_changes:
+        iso_year, iso_week = iso_week_of_date(date)
+        daily_exercise_rows.append((user_id,exercise_id,date,number_of_sets,tonnage,best_estimated_1rm))
+        week = (user_id,exercise_id,iso_year,iso_week)
+        week_sets, week_tonnage = weekly_exercise_volume.get(week,(0,0.0))
+        weekly_exercise_volume[week] = (week_sets + number_of_sets,week_tonnage + tonnage)
+        if not tonnage:
+            continue
+        coefficients = engine.coefficients[exercise_id]
+        for column in np.flatnonzero(coefficients).tolist():
+            muscle_id = engine.muscle_ids[column]
+            muscle_tonnage = tonnage*coefficients[column]
+            daily_muscle_tonnage[(user_id,muscle_id,date)] = (
+                daily_muscle_tonnage.get((user_id,muscle_id,date),0.0) + muscle_tonnage)
+            weekly_muscle_tonnage[(user_id,muscle_id,iso_year,iso_week)] = (
+                weekly_muscle_tonnage.get((user_id,muscle_id,iso_year,iso_week),0.0) + muscle_tonnage)
+
+    with session.transaction():
+        session.executemany(add_daily_exercise_volume_statement,daily_exercise_rows)
+        session.executemany(add_weekly_exercise_volume_statement,
+                            (key + volume for key,volume in weekly_exercise_volume.items()))
+        session.executemany(add_daily_muscle_volume_statement,
+                            (key + (tonnage,) for key,tonnage in daily_muscle_tonnage.items()))
+        session.executemany(add_weekly_muscle_volume_statement,
+                            (key + (tonnage,) for key,tonnage in weekly_muscle_tonnage.items()))
+
+        # Days and weeks whose last sets of an exercise were deleted are removed from the exercise rollups.
+        session.executemany('''DELETE FROM DailyExerciseVolume
+                               WHERE UserID=(?) AND ExerciseID=(?) AND Date=(?) AND NumberOfSets <= 0;''',
+                            (row[:3] for row in daily_exercise_rows if row[3] < 0))
+        session.executemany('''DELETE FROM WeeklyExerciseVolume
+                               WHERE UserID=(?) AND ExerciseID=(?) AND IsoYear=(?) AND IsoWeek=(?) AND NumberOfSets <= 0;''',
+                            (key for key,volume in weekly_exercise_volume.items() if volume[0] < 0))
+        # Likewise, muscle days and weeks whose tonnage dropped back to zero are removed from the muscle rollups.
+        session.executemany('''DELETE FROM DailyMuscleVolume
+                               WHERE UserID=(?) AND MuscleID=(?) AND Date=(?) AND ABS(Tonnage) < 1e-9;''',
+                            (key for key,tonnage in daily_muscle_tonnage.items() if tonnage < 0))
+        session.executemany('''DELETE FROM WeeklyMuscleVolume
+                               WHERE UserID=(?) AND MuscleID=(?) AND IsoYear=(?) AND IsoWeek=(?) AND ABS(Tonnage) < 1e-9;''',
+                            (key for key,tonnage in weekly_muscle_tonnage.items() if tonnage < 0))
+        if recompute_best:
+            session.executemany(recompute_best_estimated_1rm_statement,
+                                ({'user_id':user_id,'exercise_id':row[1],'date':row[2]} for row in daily_exercise_rows))
+
+
+# DailyMuscleSets is maintained from the same changes. The weighted sets of every changed (muscle, day) are added to
+# that day's row, which is created with the running total of the day before it, and to the running total of every
+# later day of that muscle. Sets are normally logged for the latest days, so there are few or no later days to
+# update; back-filling an old workout updates the running totals of the days since. Days left without sets are
+# removed, as the running total of the day before already covers them.
+
+upsert_daily_muscle_sets_statement = '''INSERT INTO DailyMuscleSets (UserID, MuscleID, Date, Sets, CumulativeSets)
+                                        VALUES (:user_id, :muscle_id, :date, :sets,
+                                                :sets + IFNULL((SELECT CumulativeSets FROM DailyMuscleSets
+                                                                WHERE UserID=(:user_id) AND MuscleID=(:muscle_id)
+                                                                AND Date<(:date) ORDER BY Date DESC LIMIT 1),0))
+                                        ON CONFLICT (UserID, MuscleID, Date) DO UPDATE SET
+                                        Sets = Sets + excluded.Sets,
+                                        CumulativeSets = CumulativeSets + excluded.Sets;'''
+
+@instrumented('apply_daily_muscle_set_changes')
+def apply_daily_muscle_set_changes(set_count_changes,session=None):
+    session = session or get_session()
+    engine = session.engine
+
+    day_ordinals, exercise_ids, set_counts = [], [], []
+
+    for date,exercise_id,number_of_sets,*volume in set_count_changes:
+        if not number_of_sets:
+            continue
+        day_ordinals.append(ordinal_of_date(date))
+        exercise_ids.append(exercise_id)
+        set_counts.append(number_of_sets)
+
+    # weekly_totals groups by any integer key; day ordinals give one row of muscle sets per day.
+    days, daily_totals = engine.weekly_totals(day_ordinals,exercise_ids,set_counts)
+    day_rows, columns = np.nonzero(daily_totals)
+    parameter_rows = [{'user_id':session.user_id,'muscle_id':engine.muscle_ids[column],
+                       'date':date_of_ordinal(day),'sets':sets}
+                      for day,column,sets in zip(days[day_rows].tolist(),columns.tolist(),
+                                                 daily_totals[day_rows,columns].tolist())]
+
+    # New days take the running total of the day before them as it was before this change list. Upserting the
+    # latest days first means the earlier days of the same list have not been added yet when that total is read;
+    # the UPDATE below then adds each day's sets to every later day exactly once.
+    parameter_rows.sort(key=lambda parameters: parameters['date'],reverse=True)
+
+    with session.transaction():
+        session.executemany(upsert_daily_muscle_sets_statement,parameter_rows)
+        session.executemany('''UPDATE DailyMuscleSets SET CumulativeSets = CumulativeSets + (:sets)
+                               WHERE UserID=(:user_id) AND MuscleID=(:muscle_id) AND Date>(:date);''',parameter_rows)
+        session.executemany('''DELETE FROM DailyMuscleSets
+                               WHERE UserID=(:user_id) AND MuscleID=(:muscle_id) AND Date=(:date)
+                               AND ABS(Sets) < 1e-9;''',
+                            (parameters for parameters in parameter_rows if parameters['sets'] < 0))
+
+
+# Applies one list of changes to WorkoutTable to every table derived from it, as one transaction: WeeklyMuscleSets,
+# the volume rollups and DailyMuscleSets. The cached query results of the changed weeks, dates and exercises are
+# dropped.
+
+def apply_workout_changes(workout_changes,recompute_best=False,session=None):
+    session = session or get_session()
+    workout_changes = list(workout_changes)
+
+    with session.transaction():
+        apply_weekly_muscle_set_changes(workout_changes,session)
+        apply_volume_changes(workout_changes,recompute_best,session)
+        apply_daily_muscle_set_changes(workout_changes,session)
+        forget_workout_hashes(workout_changes,session)
+        session.query_cache.invalidate_changes(workout_changes)
+
+
+# The content hash of a changed workout no longer describes it, so it is dropped; ingest_workout_batch stores the new
+# one after applying its changes.
+
+def forget_workout_hashes(workout_changes,session=None):
+    session = session or get_session()
+    session.executemany('DELETE FROM WorkoutHash WHERE UserID=(?) AND Date=(?);',
+                        {(session.user_id,change[0]) for change in workout_changes})
+
+
+# Generator of the changes made by adding the sets of the workout dictionary created by "create_workout_data", one per
+# exercise of every workout, in the format taken by apply_workout_changes.
+
+def workout_dictionary_changes(workout_dictionary,engine=None):
+    engine = engine or get_session().engine
+    for date,workout in workout_dictionary.items():
+        for exercise,working_sets in workout.items():
+            reps_weights = [(reps_weight.get('reps'),reps_weight.get('weight')) for reps_weight in working_sets.values()]
+            best_estimated_1rm = max((estimated_1rm(reps,weight) for reps,weight in reps_weights
+                                      if reps is not None and weight is not None),default=None)
+            yield (date,engine.exercise_ids[exercise],len(reps_weights),
+                   sum(set_tonnage(reps,weight) for reps,weight in reps_weights),best_estimated_1rm)
+
+
+# Function that takes the workout dictionary created by "create_workout_data" and adds its sets to the
+# WeeklyMuscleSets table in SQL, with one upsert per week the workouts fall in.
+
+def update_muscle_sets_in_sql_from_py(workout_dictionary,session=None):
+    session = session or get_session()
+
+    apply_weekly_muscle_set_changes(workout_dictionary_changes(workout_dictionary,session.engine),session)
+
+
+# Generator that flattens the workout dictionary created by "create_workout_data" into WorkoutTable rows of a user.
+
+def workout_set_rows(workout_dictionary,engine=None,user_id=DEFAULT_USER_ID):
+    engine = engine or get_session().engine
+    for date,workout in workout_dictionary.items():
+        iso_year, iso_week = iso_week_of_date(date)
+        for exercise,working_sets in workout.items():
+            exercise_id = engine.lookup_exercise_ids([exercise])[0].item()
+            for work_set,reps_weight in working_sets.items():
+                yield (user_id,date,exercise_id,work_set,reps_weight.get('reps'),reps_weight.get('weight'),
+                       iso_year,iso_week)
+
+
+# Function that takes the workout dictionary created by "create_workout_data" and updates WorkoutTable in SQL,
+# together with the volume rollups and DailyMuscleSets.
+
+def update_workout_table_in_sql_from_py(workout_dictionary,session=None):
+    session = session or get_session()
+
+    with session.transaction():
+        session.executemany(insert_workout_set_statement,
+                            workout_set_rows(workout_dictionary,session.engine,session.user_id))
+        workout_changes = list(workout_dictionary_changes(workout_dictionary,session.engine))
+        apply_volume_changes(workout_changes,session=session)
+        apply_daily_muscle_set_changes(workout_changes,session)
+        forget_workout_hashes(workout_changes,session)
+        session.query_cache.invalidate_changes(workout_changes)
+    
+    
+# A WorkoutBatch holds any number of sets in parallel typed columns instead of the nested workout dictionary:
+# dates as day ordinals, exercises as their ExerciseID (so every name is stored once, in the engine), and set
+# numbers, reps and weights as machine integers and doubles. It feeds both the SQL writer and the muscle set engine
+# straight from those columns. Missing reps are stored as "missing_reps" and missing weights as NaN, and are NULL in
+# WorkoutTable; a set without reps or weight counts as a set but adds no tonnage. Exercises are looked up in the
+# catalog of "engine", by default that of the pooled session (get_session().engine).
+
+class WorkoutBatch:
+    missing_reps = 0xFFFF
+
+    def __init__(self, engine=None):
+        self.engine = engine or get_session().engine
+        self.dates = array('i')
+        self.exercise_ids = array('H')
+        self.set_numbers = array('H')
+        self.reps = array('H')
+        self.weights = array('d')
+
+    @classmethod
+    def from_workout_dictionary(cls, workout_dictionary, engine=None):
+        batch = cls(engine)
+        for date,workout in workout_dictionary.items():
+            for exercise,working_sets in workout.items():
+                for work_set,reps_weight in working_sets.items():
+                    batch.append(date,exercise,work_set,reps_weight.get('reps'),reps_weight.get('weight'))
+        return batch
+
+    def __len__(self):
+        return len(self.dates)
+
+    def append(self, date, exercise, set_number, reps, weight):
+        try:
+            exercise_id = self.engine.exercise_ids[exercise]
+        except KeyError:
+            raise ValueError(f'Unknown exercise: {exercise!r}') from None
+        if not 0 <= set_number <= 0xFFFF:
+            raise ValueError(f'Set numbers must be between 0 and {0xFFFF}: {set_number!r}')
+        if reps is not None and not 0 <= reps < self.missing_reps:
+            raise ValueError(f'Reps must be between 0 and {self.missing_reps - 1}: {reps!r}')
+        if weight is not None and not np.isfinite(weight):
+            raise ValueError(f'Weights must be finite numbers: {weight!r}')
+        self.dates.append(ordinal_of_date(date))
+        self.exercise_ids.append(exercise_id)
+        self.set_numbers.append(set_number)
+        self.reps.append(self.missing_reps if reps is None else reps)
+        self.weights.append(np.nan if weight is None else weight)
+
+    # Generator of the (day ordinal, exercise ID, set number, reps, weight) of every set, with None for missing reps
+    # and weights.
+    def sets(self):
+        for ordinal,exercise_id,set_number,reps,weight in zip(self.dates,self.exercise_ids,self.set_numbers,
+                                                              self.reps,self.weights):
+            yield (ordinal,exercise_id,set_number,None if reps == self.missing_reps else reps,
+                   None if weight != weight else weight)
+
+    # Generator of WorkoutTable rows for insert_workout_set_statement; rows are produced one at a time while
+    # executemany consumes them. The sets belong to "user_id".
+    def rows(self, user_id=DEFAULT_USER_ID):
+        for ordinal,exercise_id,set_number,reps,weight in self.sets():
+            date = date_of_ordinal(ordinal)
+            iso_year, iso_week = iso_week_of_date(date)
+            yield (user_id,date,exercise_id,set_number,reps,weight,iso_year,iso_week)
+
+    # Number of sets, tonnage and best estimated 1RM per (date, exercise ID), computed with NumPy over the columns, in
+    # the format taken by apply_workout_changes.
+    @instrumented('WorkoutBatch.workout_changes')
+    def workout_changes(self):
+        number_of_exercises = len(self.engine.exercise_names)
+        keys = (np.frombuffer(self.dates,dtype=np.int32).astype(np.int64)*number_of_exercises
+                + np.frombuffer(self.exercise_ids,dtype=np.uint16))
+        unique_keys, key_index, set_counts = np.unique(keys,return_inverse=True,return_counts=True)
+        reps = np.frombuffer(self.reps,dtype=np.uint16).astype(np.float64)
+        weights = np.frombuffer(self.weights,dtype=np.float64)
+        complete = (reps != self.missing_reps) & ~np.isnan(weights)
+        tonnage = np.bincount(key_index,weights=np.where(complete,reps*weights,0.0),minlength=len(unique_keys))
+        best_estimated_1rm = np.full(len(unique_keys),-np.inf)
+        np.maximum.at(best_estimated_1rm,key_index,
+                      np.where(complete,np.where(reps == 1,weights,weights*(1 + reps/30)),-np.inf))
+        changes = []
+        for key,number_of_sets,key_tonnage,key_best in zip(unique_keys.tolist(),set_counts.tolist(),
+                                                          tonnage.tolist(),best_estimated_1rm.tolist()):
+            ordinal, exercise_id = divmod(key,number_of_exercises)
+            changes.append((date_of_ordinal(ordinal),exercise_id,number_of_sets,key_tonnage,
+                            None if key_best == -np.inf else key_best))
+        return changes
+
+
+# Writes a WorkoutBatch to WorkoutTable and adds its sets to WeeklyMuscleSets and the volume rollups, as one
+# transaction. Sets that are already stored raise sqlite3.IntegrityError; ingest_workout_batch writes a batch that
+# may repeat stored sets.
+
+def write_workout_batch(batch,session=None):
+    session = session or get_session()
+
+    with session.transaction():
+        session.executemany(insert_workout_set_statement,batch.rows(session.user_id))
+        apply_workout_changes(batch.workout_changes(),session=session)
+
+
+# Content hash of a workout, from its (exercise ID, set number, reps, weight) sets in any order.
+
+def workout_content_hash(workout_sets):
+    return hashlib.blake2b(repr(sorted(workout_sets)).encode(),digest_size=16).digest()
+
+
+# Writes a WorkoutBatch idempotently, so a workout that is submitted again, or a batch that is retried, is never
+# counted twice. Every date of the batch is a workout. A workout whose content hash matches the stored one is skipped
+# without any write. Otherwise its stored sets are read and compared set by set on (exercise, set number): new sets are
+# inserted, sets with other reps or weight are updated and, with replace=True, stored sets missing from the batch are
+# deleted, so the batch replaces the workout. Only the difference is applied to the derived tables. replace=False
+# keeps the sets missing from the batch, for batches that may hold part of a workout (e.g. chunks of an import).
+# Returns the number of workouts skipped and changed and of sets inserted, updated and deleted.
+
+upsert_workout_set_statement = insert_workout_set_statement.replace(';','''
+                                    ON CONFLICT (UserID, Date, ExerciseID, SetNumber) DO UPDATE SET
+                                    Reps = excluded.Reps, Weight = excluded.Weight;''')
+
+def ingest_workout_batch(batch,replace=True,session=None):
+    session = session or get_session()
+    user_id = session.user_id
+    workouts = {}
+    for ordinal,exercise_id,set_number,reps,weight in batch.sets():
+        workouts.setdefault(date_of_ordinal(ordinal),{})[(exercise_id,set_number)] = (reps,weight)
+
+    stats = {'workouts_skipped':0,'workouts_changed':0,'sets_inserted':0,'sets_updated':0,'sets_deleted':0}
+    with session.transaction():
+        for date,new_sets in workouts.items():
+            content_hash = workout_content_hash([key + reps_weight for key,reps_weight in new_sets.items()])
+            stored_hash = session.execute('SELECT ContentHash FROM WorkoutHash WHERE UserID=(?) AND Date=(?);',
+                                          (user_id,date)).fetchone()
+            if stored_hash is not None and stored_hash[0] == content_hash:
+                stats['workouts_skipped'] += 1
+                continue
+
+            old_sets = {(exercise_id,set_number):(reps,weight) for exercise_id,set_number,reps,weight in session.execute(
+                'SELECT ExerciseID,SetNumber,Reps,Weight FROM WorkoutTable WHERE UserID=(?) AND Date=(?);',(user_id,date))}
+            written_sets = {key:reps_weight for key,reps_weight in new_sets.items() if old_sets.get(key) != reps_weight}
+            deleted_sets = [key for key in old_sets if key not in new_sets] if replace else []
+
+            # (number of sets, tonnage, best estimated 1RM of the added sets) per exercise.
+            exercise_changes = {}
+            for key,(reps,weight) in written_sets.items():
+                number_of_sets, tonnage, best_estimated_1rm = exercise_changes.get(key[0],(0,0.0,None))
+                if key in old_sets:
+                    tonnage -= set_tonnage(*old_sets[key])
+                else:
+                    number_of_sets += 1
+                if reps is not None and weight is not None:
+                    best_estimated_1rm = max(best_estimated_1rm or 0.0,estimated_1rm(reps,weight))
+                exercise_changes[key[0]] = (number_of_sets,tonnage + set_tonnage(reps,weight),best_estimated_1rm)
+            for key in deleted_sets:
+                number_of_sets, tonnage, best_estimated_1rm = exercise_changes.get(key[0],(0,0.0,None))
+                exercise_changes[key[0]] = (number_of_sets - 1,tonnage - set_tonnage(*old_sets[key]),best_estimated_1rm)
+
+            if exercise_changes:
+                iso_year, iso_week = iso_week_of_date(date)
+                session.executemany(upsert_workout_set_statement,
+                                    [(user_id,date,exercise_id,set_number,reps,weight,iso_year,iso_week)
+                                     for (exercise_id,set_number),(reps,weight) in written_sets.items()])
+                session.executemany('''DELETE FROM WorkoutTable
+                                       WHERE UserID=(?) AND Date=(?) AND ExerciseID=(?) AND SetNumber=(?);''',
+                                    [(user_id,date) + key for key in deleted_sets])
+                apply_workout_changes([(date,exercise_id) + change for exercise_id,change in exercise_changes.items()],
+                                      recompute_best=bool(deleted_sets) or any(key in old_sets for key in written_sets),
+                                      session=session)
+                stats['workouts_changed'] += 1
+                stats['sets_inserted'] += sum(key not in old_sets for key in written_sets)
+                stats['sets_updated'] += sum(key in old_sets for key in written_sets)
+                stats['sets_deleted'] += len(deleted_sets)
+
+            stored_sets = new_sets if replace else {**old_sets,**new_sets}
+            session.execute('''INSERT INTO WorkoutHash (UserID, Date, ContentHash) VALUES (?, ?, ?)
+                               ON CONFLICT (UserID, Date) DO UPDATE SET ContentHash = excluded.ContentHash;''',
+                            (user_id,date,workout_content_hash([key + reps_weight
+                                                                for key,reps_weight in stored_sets.items()])))
+    return stats
+
+
+# User inputs their workout(s) and updates both workout data AND weekly muscle sets in SQL, as one transaction.
+# Entered sets are added to the workout of their date; a set that is entered again replaces the stored one, while the
+# other sets already stored for that date are kept.
+
+def insert_new_workout_into_sql(session=None):
+    session = session or get_session()
+    workout_dictionary = create_workout_data()
+    
+    ingest_workout_batch(WorkoutBatch.from_workout_dictionary(workout_dictionary,session.engine),replace=False,
+                         session=session)
 
-    unique_week_id = []
-    for data in date_exercise_number_of_sets:
-        week_id = data[0]
-        if week_id not in unique_week_id:
-            unique_week_id.append(week_id)
 
-    for week_id in unique_week_id:
+# In[12]:
 
-        muscle_sets = {'Lats':0, 'Lower_Back':0,'Trapezius':0,
-                       'Front_Deltoids':0, 'Side_Deltoids':0, 'Rear_Deltoids':0,
-                       'Pectorals':0,
-                       'Triceps':0, 'Biceps':0, 'Forearms':0,
-                       'Abdominals':0,
-                       'Glutes':0, 'Hamstrings':0, 'Quadriceps':0, 'Calves':0,
-                       'Neck':0}
 
-        for data in date_exercise_number_of_sets:
-            week_num = data[0]
-            exercise = data[1]
-            number_of_sets = data[2]
+# Updates WeeklyMuscleSets from a muscle set dictionary accquired from WorkoutTable.
 
-            if week_num == week_id:
-                muscle_groups = exercise_list.get(exercise)
-                for muscle,mover_var in muscle_groups.items():
-                    if mover_var == 1:
-                        muscle_sets[muscle] += number_of_sets
-                    elif mover_var == 2:
-                        muscle_sets[muscle] += number_of_sets*(2/3)
-                    else:
-                        muscle_sets[muscle] += number_of_sets*(1/3)
-                        
+def update_all_weekly_muscle_sets_in_sql_from_workout_table(muscle_sets,week_id,iso_year,session=None):
+    session = session or get_session()
 
-        update_all_muscle_sets_in_sql_from_workout_table(muscle_sets)
-                        
-    conn.commit()
-    conn.close()
+    with session.transaction():
+        session.execute(replace_weekly_muscle_sets_statement,
+                        weekly_muscle_sets_parameters(muscle_sets,week_id,iso_year,session.user_id))
+    
+# Updates ALL of the rows in WeeklyMuscleSets from data accquired from WorkoutTable. Inserts, updates and deletes keep
+# WeeklyMuscleSets up to date on their own, so this is only needed to reconcile the table with WorkoutTable. By
+# default the whole aggregation runs inside SQLite (see rebuild_weekly_muscle_sets_in_sql); with
+# aggregate_in_sql=False, per-week set counts are fetched and multiplied out by the muscle set engine instead. Every
+# user of the database is rebuilt.
+
+def update_all_weekly_muscle_sets_in_sql(session=None,aggregate_in_sql=True):
+    session = session or get_session()
+    
+    if aggregate_in_sql:
+        return rebuild_weekly_muscle_sets_in_sql(session)
+
+    exercise_data_sql = session.execute('''SELECT UserID,IsoYear,IsoWeek,ExerciseID,COUNT(ExerciseID) 
+                                           FROM WorkoutTable 
+                                           GROUP BY UserID,IsoYear,IsoWeek,ExerciseID;''').fetchall()
+
+    user_set_counts = {}
+    for user_id,iso_year,iso_week,exercise_id,number_of_sets in exercise_data_sql:
+        week_ids, exercise_ids, set_counts = user_set_counts.setdefault(user_id,([],[],[]))
+        week_ids.append(week_key(iso_year,iso_week))
+        exercise_ids.append(exercise_id)
+        set_counts.append(number_of_sets)
+
+    with session.transaction():
+        # Weeks that no longer have any sets in WorkoutTable are reset as well.
+        session.execute(f'''UPDATE WeeklyMuscleSets SET {', '.join(f'{muscle} = 0' for muscle in muscle_names)};''')
+        for user_id,(week_ids,exercise_ids,set_counts) in user_set_counts.items():
+            weekly_muscle_sets = session.engine.weekly_muscle_sets(week_ids,exercise_ids,set_counts)
+            session.executemany(replace_weekly_muscle_sets_statement,
+                                weekly_muscle_sets_parameter_rows(weekly_muscle_sets,user_id))
+
+
+# Builds the INSERT ... SELECT that computes weekly muscle sets inside SQLite: sets are counted per user, week and
+# exercise, joined to ExerciseMover, and SUM(number of sets * coefficient) is pivoted into one column per muscle for
+# every week of every user.
+
+def weekly_muscle_sets_aggregation_statement(session):
+    muscle_ids = dict(session.execute('SELECT Name,MuscleID FROM Muscle;').fetchall())
+    muscle_sums = ',\n'.join(f'''SUM(CASE ExerciseMover.MuscleID WHEN {muscle_ids[muscle]} 
+                                   THEN WeeklySets.NumberOfSets*ExerciseMover.Coefficient ELSE 0 END)''' 
+                             for muscle in muscle_names)
+    return f'''INSERT INTO WeeklyMuscleSets (UserID, IsoYear, WeekID, {weekly_muscle_sets_columns})
+               SELECT WeeklySets.UserID, WeeklySets.IsoYear, WeeklySets.IsoWeek, {muscle_sums}
+               FROM (SELECT UserID,IsoYear,IsoWeek,ExerciseID,COUNT(ExerciseID) AS NumberOfSets 
+                     FROM WorkoutTable 
+                     GROUP BY UserID,IsoYear,IsoWeek,ExerciseID) AS WeeklySets
+               JOIN ExerciseMover USING (ExerciseID)
+               WHERE true
+               GROUP BY WeeklySets.UserID,WeeklySets.IsoYear,WeeklySets.IsoWeek
+               ON CONFLICT (UserID, IsoYear, WeekID) DO UPDATE SET 
+               {', '.join(f'{muscle} = excluded.{muscle}' for muscle in muscle_names)};'''
+
+
+# Rebuilds every week of WeeklyMuscleSets with a single SQL statement, so no workout rows pass through Python.
+
+def rebuild_weekly_muscle_sets_in_sql(session=None):
+    session = session or get_session()
+    
+    with session.transaction():
+        # Weeks that no longer have any sets in WorkoutTable are reset as well.
+        session.execute(f'''UPDATE WeeklyMuscleSets SET {', '.join(f'{muscle} = 0' for muscle in muscle_names)};''')
+        session.execute(weekly_muscle_sets_aggregation_statement(session))
+
+
+# Rebuilds the volume rollup tables and DailyMuscleSets of every user from WorkoutTable inside SQLite. Like the
+# WeeklyMuscleSets rebuild, this is only needed to reconcile them, since every write keeps them up to date.
+
+def rebuild_volume_rollups(session=None):
+    session = session or get_session()
+
+    with session.transaction():
+        for rollup_table in ('DailyExerciseVolume','WeeklyExerciseVolume','DailyMuscleVolume','WeeklyMuscleVolume',
+                             'DailyMuscleSets'):
+            session.execute(f'DELETE FROM {rollup_table};')
+        session.execute(f'''INSERT INTO DailyExerciseVolume (UserID, ExerciseID, Date, NumberOfSets, Tonnage, BestEstimated1RM)
+                            SELECT UserID,ExerciseID,Date,COUNT(ExerciseID),TOTAL(Reps*Weight),MAX({estimated_1rm_sql})
+                            FROM WorkoutTable
+                            GROUP BY UserID,ExerciseID,Date;''')
+        session.execute('''INSERT INTO WeeklyExerciseVolume (UserID, ExerciseID, IsoYear, IsoWeek, NumberOfSets, Tonnage)
+                           SELECT UserID,ExerciseID,IsoYear,IsoWeek,COUNT(ExerciseID),TOTAL(Reps*Weight)
+                           FROM WorkoutTable
+                           GROUP BY UserID,ExerciseID,IsoYear,IsoWeek;''')
+        session.execute('''INSERT INTO DailyMuscleVolume (UserID, MuscleID, Date, Tonnage)
+                           SELECT UserID,MuscleID,Date,SUM(Tonnage*Coefficient)
+                           FROM DailyExerciseVolume JOIN ExerciseMover USING (ExerciseID)
+                           GROUP BY UserID,MuscleID,Date
+                           HAVING ABS(SUM(Tonnage*Coefficient)) >= 1e-9;''')
+        session.execute('''INSERT INTO WeeklyMuscleVolume (UserID, MuscleID, IsoYear, IsoWeek, Tonnage)
+                           SELECT UserID,MuscleID,IsoYear,IsoWeek,SUM(Tonnage*Coefficient)
+                           FROM WeeklyExerciseVolume JOIN ExerciseMover USING (ExerciseID)
+                           GROUP BY UserID,MuscleID,IsoYear,IsoWeek
+                           HAVING ABS(SUM(Tonnage*Coefficient)) >= 1e-9;''')
+        session.execute('''INSERT INTO DailyMuscleSets (UserID, MuscleID, Date, Sets, CumulativeSets)
+                           SELECT UserID,MuscleID,Date,Sets,SUM(Sets) OVER (PARTITION BY UserID,MuscleID ORDER BY Date)
+                           FROM (SELECT UserID,MuscleID,Date,SUM(NumberOfSets*Coefficient) AS Sets
+                                 FROM DailyExerciseVolume JOIN ExerciseMover USING (ExerciseID)
+                                 GROUP BY UserID,MuscleID,Date)
+                           WHERE Sets != 0;''')
+
+
+# Reconciles WeeklyMuscleSets with WorkoutTable without a full rebuild. The fingerprint of a week is its number of
+# sets and a checksum of their exercise IDs, which is all WeeklyMuscleSets is derived from, and the fingerprints of
+# every week are read in one scan of the covering WorkoutTableWeekIndex. Only the weeks whose fingerprint differs
+# from the one stored when they were last verified are recomputed with the muscle set engine and compared muscle by
+# muscle with WeeklyMuscleSets; full=True checks every week, as does the first run. Drifted weeks are overwritten
+# with the recomputed totals, zeros included, unless repair=False. Returns the weeks checked, the drifted weeks with
+# their (stored, expected) sets per muscle, and the number of drifted weeks and total drift per muscle.
+
+week_fingerprint_statement = '''SELECT UserID,IsoYear,IsoWeek,COUNT(*),SUM((ExerciseID*2654435761) % 4294967291)
+                                FROM WorkoutTable
+                                GROUP BY UserID,IsoYear,IsoWeek;'''
+
+def verify_weekly_muscle_sets(full=False,repair=True,session=None):
+    session = session or get_session()
+    engine = session.engine
+    started = time.perf_counter()
+
+    with session.transaction():
+        fingerprints = {row[:3]:row[3:] for row in session.execute(week_fingerprint_statement)}
+        stored_fingerprints = {row[:3]:row[3:] for row in session.execute(
+            'SELECT UserID,IsoYear,IsoWeek,NumberOfSets,Checksum FROM WeekFingerprint;')}
+        stored_weeks = {row[:3]:row[3:] for row in session.execute(
+            f'SELECT UserID,IsoYear,WeekID,{weekly_muscle_sets_columns} FROM WeeklyMuscleSets;')}
+        if full or not stored_fingerprints:
+            changed_weeks = fingerprints.keys() | stored_fingerprints.keys() | stored_weeks.keys()
+        else:
+            changed_weeks = {week for week in fingerprints.keys() | stored_fingerprints.keys()
+                             if fingerprints.get(week) != stored_fingerprints.get(week)}
+
+        drifted_weeks = []
+        muscle_drift = {muscle:{'weeks':0,'sets':0.0} for muscle in muscle_names}
+        for user_id,iso_year,iso_week in sorted(changed_weeks):
+            exercise_set_counts = session.execute('''SELECT ExerciseID,COUNT(*) FROM WorkoutTable
+                                                     WHERE UserID=(?) AND IsoYear=(?) AND IsoWeek=(?)
+                                                     GROUP BY ExerciseID;''',(user_id,iso_year,iso_week)).fetchall()
+            expected = engine.muscle_sets([row[0] for row in exercise_set_counts],[row[1] for row in exercise_set_counts])
+            stored = dict(zip(muscle_names,stored_weeks.get((user_id,iso_year,iso_week),(0.0,)*len(muscle_names))))
+            drifted_muscles = {muscle:(stored[muscle],expected[muscle]) for muscle in muscle_names
+                               if abs(stored[muscle] - expected[muscle]) > 1e-6}
+            if not drifted_muscles:
+                continue
+            drifted_weeks.append({'user_id':user_id,'iso_year':iso_year,'iso_week':iso_week,'muscles':drifted_muscles})
+            for muscle,(stored_sets,expected_sets) in drifted_muscles.items():
+                muscle_drift[muscle]['weeks'] += 1
+                muscle_drift[muscle]['sets'] += abs(stored_sets - expected_sets)
+            if repair:
+                session.execute(replace_weekly_muscle_sets_statement,
+                                weekly_muscle_sets_parameters(expected,iso_week,iso_year,user_id))
+
+        # Weeks that still drift after verifying are left out, so they are checked again next time.
+        if repair or not drifted_weeks:
+            unrepaired_weeks = set()
+        else:
+            unrepaired_weeks = {(week['user_id'],week['iso_year'],week['iso_week']) for week in drifted_weeks}
+        session.executemany('DELETE FROM WeekFingerprint WHERE UserID=(?) AND IsoYear=(?) AND IsoWeek=(?);',
+                            [week for week in changed_weeks if week not in fingerprints or week in unrepaired_weeks])
+        session.executemany('''INSERT INTO WeekFingerprint (UserID, IsoYear, IsoWeek, NumberOfSets, Checksum)
+                               VALUES (?, ?, ?, ?, ?)
+                               ON CONFLICT (UserID, IsoYear, IsoWeek) DO UPDATE SET
+                               NumberOfSets = excluded.NumberOfSets, Checksum = excluded.Checksum;''',
+                            [week + fingerprints[week] for week in changed_weeks
+                             if week in fingerprints and week not in unrepaired_weeks])
+
+    return {'weeks':len(fingerprints),
+            'weeks_checked':len(changed_weeks),
+            'drifted_weeks':drifted_weeks,
+            'muscles':{muscle:drift for muscle,drift in muscle_drift.items() if drift['weeks']},
+            'repaired':repair,
+            'seconds':time.perf_counter() - started}
 
 
 # In[13]:
 
 
-# Function gets the start and end date from a week number for the purpose of SQL querying.
+# Function gets the start and end date from a week number and its ISO year for the purpose of SQL querying.
 
-def give_week_start_and_end_date_from_week_number(week_number):
-    d = '{}-W{}'.format('2019',week_number)
-    start_date = datetime.strptime(d + '-1', '%G-W%V-%u').date()
-    end_date = datetime.strptime(d + '-7', '%G-W%V-%u').date()
+def give_week_start_and_end_date_from_week_number(week_number,iso_year):
+    start_date = date.fromisocalendar(iso_year,week_number,1)
+    end_date = date.fromisocalendar(iso_year,week_number,7)
     return [str(start_date),str(end_date)]
 
 
 # Function that returns "date_exercise_number_of_sets", a list that returns information from WorkoutTable in SQL in
 # a format that can be utilized by later functions.
 
-def get_weekly_muscle_sets_from_sql_workout_table(week_id):
-    conn = sqlite3.connect('LiftAppTest42.db')
-    c = conn.cursor()
+def get_weekly_muscle_sets_from_sql_workout_table(week_id,iso_year,session=None):
+    session = session or get_session()
 
-    start_date = give_week_start_and_end_date_from_week_number(week_id)[0]
-    end_date = give_week_start_and_end_date_from_week_number(week_id)[-1]
+    start_date, end_date = give_week_start_and_end_date_from_week_number(week_id,iso_year)
 
-    sql_statement = '''SELECT Date,Exercise,COUNT(Exercise) 
+    sql_statement = '''SELECT Date,ExerciseID,COUNT(ExerciseID) 
                     FROM WorkoutTable
-                    WHERE Date BETWEEN (:start_date) AND (:end_date)
-                    GROUP BY Date,Exercise'''
-    parameters = {'start_date':start_date,'end_date':end_date}
+                    WHERE UserID=(:user_id) AND Date BETWEEN (:start_date) AND (:end_date)
+                    GROUP BY Date,ExerciseID'''
+    parameters = {'user_id':session.user_id,'start_date':start_date,'end_date':end_date}
 
-    c.execute(sql_statement,parameters)
-    exercise_data_sql = c.fetchall()
+    exercise_data_sql = session.cached_query(('week',iso_year,week_id,'exercise_set_counts'),
+                                             lambda: session.execute(sql_statement,parameters).fetchall())
     
-    date_exercise_number_of_sets = [[int(datetime.strptime(data[0],'%Y-%m-%d').strftime('%V')),
-                                 data[1],
-                                 data[2]] for data in exercise_data_sql]
-    
-    conn.commit()
-    conn.close()
+    # Every row falls inside the requested week, so there is no need to parse the dates.
+    exercise_names = session.engine.exercise_names
+    date_exercise_number_of_sets = [[week_id,exercise_names[data[1]],data[2]] for data in exercise_data_sql]
     
     return date_exercise_number_of_sets
 
 
 # Utilizes the "date_exercise_number_of_sets" list to create a python muscle set dictionary.
 
-def create_py_muscle_sets_from_sql_workout_table(date_exercise_number_of_sets):
+def create_py_muscle_sets_from_sql_workout_table(date_exercise_number_of_sets,engine=None):
+        engine = engine or get_session().engine
         
-        muscle_sets = {'Lats':0.0, 'Lower_Back':0.0,'Trapezius':0.0,
-                   'Front_Deltoids':0.0, 'Side_Deltoids':0.0, 'Rear_Deltoids':0.0,
-                   'Pectorals':0.0,
-                   'Triceps':0.0, 'Biceps':0.0, 'Forearms':0.0,
-                   'Abdominals':0.0,
-                   'Glutes':0.0, 'Hamstrings':0.0, 'Quadriceps':0.0, 'Calves':0.0,
-                   'Neck':0.0}
+        exercise_ids = engine.lookup_exercise_ids(data[1] for data in date_exercise_number_of_sets)
+        set_counts = [data[2] for data in date_exercise_number_of_sets]
         
-        for data in date_exercise_number_of_sets:
-            week_number = data[0]
-            exercise = data[1]
-            number_of_sets = data[2]
-            
-            muscle_groups = exercise_list.get(exercise)
-            for muscle,mover_var in muscle_groups.items():
-                if mover_var == 1:
-                    muscle_sets[muscle] += number_of_sets
-                elif mover_var == 2:
-                    muscle_sets[muscle] += number_of_sets*(2/3)
-                else:
-                    muscle_sets[muscle] += number_of_sets*(1/3)
-                    
-        return muscle_sets
+        return engine.muscle_sets(exercise_ids,set_counts)
 
     
 # Updates the WeeklyMuscleSets table with information gained from the previous functions.
 
-def update_weekly_muscle_sets_in_sql_from_workout_table(muscle_sets,week_id):
-    conn = sqlite3.connect('LiftAppTest42.db')
-    c = conn.cursor()
-    
-    for muscle in muscle_sets.keys():# Updates SQL table with the muscle_set data for that week
-        num_sets =  muscle_sets.get(muscle)
-        if num_sets != 0:
-            sql_statement = f'''UPDATE WeeklyMuscleSets 
-                                SET {muscle} = (:num_sets)
-                                WHERE WeekID=(:week_id);'''
-            parameters = {'num_sets':num_sets,'week_id':week_id}
-            c.execute(sql_statement,parameters)
-            
-    conn.commit()
-    conn.close()
+def update_weekly_muscle_sets_in_sql_from_workout_table(muscle_sets,week_id,iso_year,session=None):
+    session = session or get_session()
     
+    with session.transaction():
+        session.execute(replace_weekly_muscle_sets_statement,
+                        weekly_muscle_sets_parameters(muscle_sets,week_id,iso_year,session.user_id))
     
-# Takes a week number and updates the WeeklyMuscleSets table after a change in the data.
-
-def specific_weekly_muscle_sets_update_sql(week_number):
-#     week_number = int(datetime.strptime(date,'%Y-%m-%d').strftime('%V'))
-    
-    week_number_exercise_number_of_sets = get_weekly_muscle_sets_from_sql_workout_table(week_number)
     
-    weekly_muscle_sets = create_py_muscle_sets_from_sql_workout_table(week_number_exercise_number_of_sets)
+# Takes a week number and its ISO year and updates the WeeklyMuscleSets table after a change in the data.
+
+def specific_weekly_muscle_sets_update_sql(week_number,iso_year,session=None):
+    session = session or get_session()
     
-    update_weekly_muscle_sets_in_sql_from_workout_table(weekly_muscle_sets,week_number)
+    with session.transaction():
+        week_number_exercise_number_of_sets = get_weekly_muscle_sets_from_sql_workout_table(week_number,iso_year,session)
+        
+        weekly_muscle_sets = create_py_muscle_sets_from_sql_workout_table(week_number_exercise_number_of_sets,
+                                                                          session.engine)
+        
+        update_weekly_muscle_sets_in_sql_from_workout_table(weekly_muscle_sets,week_number,iso_year,session)
+
+
+# Progress of an exercise over time, read from the volume rollups instead of WorkoutTable: one
+# (Date, NumberOfSets, Tonnage, BestEstimated1RM) row per training day, or one (IsoYear, IsoWeek, NumberOfSets,
+# Tonnage) row per week with by_week=True.
+
+def get_exercise_progress(exercise,by_week=False,session=None):
+    session = session or get_session()
+    exercise_id = session.engine.exercise_ids.get(exercise)
+
+    if by_week:
+        sql_statement = '''SELECT IsoYear,IsoWeek,NumberOfSets,Tonnage FROM WeeklyExerciseVolume
+                           WHERE UserID=(:user_id) AND ExerciseID=(:exercise_id) ORDER BY IsoYear,IsoWeek;'''
+    else:
+        sql_statement = '''SELECT Date,NumberOfSets,Tonnage,BestEstimated1RM FROM DailyExerciseVolume
+                           WHERE UserID=(:user_id) AND ExerciseID=(:exercise_id) ORDER BY Date;'''
+    return session.execute(sql_statement,{'user_id':session.user_id,'exercise_id':exercise_id}).fetchall()
+
+
+# Tonnage of a muscle over time, weighted by the mover coefficients: one (IsoYear, IsoWeek, Tonnage) row per week, or
+# one (Date, Tonnage) row per training day with by_week=False.
+
+def get_muscle_volume(muscle,by_week=True,session=None):
+    session = session or get_session()
+    if muscle not in muscle_names:
+        raise ValueError(f'Unknown muscle: {muscle!r}')
+    muscle_id = session.engine.muscle_ids[muscle_names.index(muscle)]
+
+    if by_week:
+        sql_statement = '''SELECT IsoYear,IsoWeek,Tonnage FROM WeeklyMuscleVolume
+                           WHERE UserID=(:user_id) AND MuscleID=(:muscle_id) ORDER BY IsoYear,IsoWeek;'''
+    else:
+        sql_statement = '''SELECT Date,Tonnage FROM DailyMuscleVolume
+                           WHERE UserID=(:user_id) AND MuscleID=(:muscle_id) ORDER BY Date;'''
+    return session.execute(sql_statement,{'user_id':session.user_id,'muscle_id':muscle_id}).fetchall()
+
+
+# Running totals of the weighted sets of every muscle up to and including a date, as an array in the order of
+# muscle_names. Each is the CumulativeSets of the muscle's last training day on or before the date.
+
+cumulative_muscle_sets_statement = '''SELECT MuscleID,(SELECT CumulativeSets FROM DailyMuscleSets
+                                                       WHERE UserID=(:user_id) AND MuscleID=Muscle.MuscleID
+                                                       AND Date<=(:date) ORDER BY Date DESC LIMIT 1)
+                                      FROM Muscle;'''
+
+def get_cumulative_muscle_sets(date,session=None):
+    session = session or get_session()
+    cumulative_sets = dict(session.execute(cumulative_muscle_sets_statement,
+                                           {'user_id':session.user_id,'date':date}).fetchall())
+    return np.array([cumulative_sets.get(muscle_id) or 0.0 for muscle_id in session.engine.muscle_ids])
+
+
+# Weighted sets of every muscle in the "days" days ending on end_date (inclusive), as a muscle sets dictionary.
+
+def get_rolling_muscle_sets(end_date,days=7,session=None):
+    session = session or get_session()
+    end_ordinal = ordinal_of_date(end_date)
+    window_sets = (get_cumulative_muscle_sets(end_date,session)
+                   - get_cumulative_muscle_sets(date_of_ordinal(end_ordinal - days),session))
+    return dict(zip(muscle_names,window_sets.tolist()))
+
+
+# Acute:chronic workload ratio of every muscle on end_date: the sets of the last acute_days days against the sets of
+# the last chronic_days days, scaled to the same number of days. Returns {muscle: (acute sets, chronic sets, ratio)},
+# with a ratio of None for muscles without any chronic load.
+
+def get_acute_chronic_workload(end_date,acute_days=7,chronic_days=28,session=None):
+    session = session or get_session()
+    end_ordinal = ordinal_of_date(end_date)
+    end_sets = get_cumulative_muscle_sets(end_date,session)
+    acute_sets = end_sets - get_cumulative_muscle_sets(date_of_ordinal(end_ordinal - acute_days),session)
+    chronic_sets = end_sets - get_cumulative_muscle_sets(date_of_ordinal(end_ordinal - chronic_days),session)
+    return {muscle:(acute,chronic,acute/(chronic*acute_days/chronic_days) if chronic > 1e-9 else None)
+            for muscle,acute,chronic in zip(muscle_names,acute_sets.tolist(),chronic_sets.tolist())}
+
+
+# Daily series of the rolling window sets of every muscle from start_date to end_date (inclusive). Returns the dates
+# as a datetime64[D] array and a (days x muscles) matrix, columns in the order of muscle_names. Only the running
+# totals before the first window and the training days of the range are read; the series is one cumulative sum.
+
+def get_rolling_muscle_set_series(start_date,end_date,days=7,session=None):
+    session = session or get_session()
+    first_ordinal = ordinal_of_date(start_date) - days
+    last_ordinal = ordinal_of_date(end_date)
+    muscle_columns = {muscle_id:column for column,muscle_id in enumerate(session.engine.muscle_ids)}
+
+    daily_sets = np.zeros((max(last_ordinal - first_ordinal,0) + 1,len(muscle_names)))
+    daily_sets[0] = get_cumulative_muscle_sets(date_of_ordinal(first_ordinal),session)
+    rows = session.execute(f'''SELECT MuscleID,Date,Sets FROM DailyMuscleSets
+                               WHERE UserID=(:user_id) AND MuscleID IN ({','.join(map(str,muscle_columns))})
+                               AND Date>(:first_date) AND Date<=(:end_date);''',
+                           {'user_id':session.user_id,'first_date':date_of_ordinal(first_ordinal),
+                            'end_date':end_date}).fetchall()
+    if rows:
+        muscle_ids, dates, sets = zip(*rows)
+        day_index = (np.array(dates,dtype='datetime64[D]').astype(np.int64)
+                     - (first_ordinal - date(1970,1,1).toordinal()))
+        np.add.at(daily_sets,(day_index,[muscle_columns[muscle_id] for muscle_id in muscle_ids]),sets)
+    cumulative_sets = np.cumsum(daily_sets,axis=0)
+
+    dates = np.arange(first_ordinal + days,last_ordinal + 1) - date(1970,1,1).toordinal()
+    return dates.astype('datetime64[D]'), cumulative_sets[days:] - cumulative_sets[:len(cumulative_sets) - days]
 
 
 # In[14]:
 
 
+# Columns of a set as shown to the user, with the exercise name looked up from the Exercise table.
+
+workout_set_columns = 'Date,Exercise.Name AS Exercise,SetNumber,Reps,Weight'
+
+
 # Function that allows the user to view workout data that has been logged.
 
-def read():
-    conn = sqlite3.connect('LiftAppTest42.db')
-    c = conn.cursor()
+def read(session=None):
+    session = session or get_session()
     
     workout_query = input("Do you want to look up a workout, an exercise, or both? ").strip().lower()
     while workout_query not in ('workout','exercise','both'):
@@ -420,40 +1844,163 @@ def read():
     if workout_query == 'workout':
         date = input("What date do you want to view? YYYY-MM-DD ")
         
-        sql_statement = '''SELECT * FROM WorkoutTable 
-                            WHERE Date=(:date)
-                            GROUP BY Exercise,SetNumber;'''
-        c.execute(sql_statement,{'date':date})
-
-        return c.fetchall()
+        return lookup_workout_sets(date,session=session)
     elif workout_query == 'exercise':
         exercise = input("What exercise do you want to view? ")
         
-        sql_statement = 'SELECT * FROM WorkoutTable WHERE Exercise=(:exercise) ORDER BY Date;'
-        c.execute(sql_statement,{'exercise':exercise})
-        
-        return c.fetchall()
-    else: # Update this with the capability of viewing multiple dates and exercises!
-        date = input("What date do you want to view? YYYY-MM-DD ")
-        exercise = input("What exercise do you want to view? ")
-        
-        sql_statement = 'SELECT * FROM WorkoutTable WHERE Date=(:date) AND Exercise=(:exercise);'
-        c.execute(sql_statement,{'date':date,'exercise':exercise})
-        
-        return c.fetchall()
+        return lookup_workout_sets(exercise=exercise,session=session)
+    else:
+        start_date = input("From what date do you want to view? YYYY-MM-DD ").strip() or None
+        end_date = input("Until what date do you want to view? YYYY-MM-DD ").strip() or None
+        exercises = [exercise.strip() for exercise in input("What exercises do you want to view? Separate them with commas ").split(',')
+                     if exercise.strip()]
+
+        with closing(query_workout_sets(start_date,end_date,exercises or None,session=session)) as workout_sets:
+            return list(workout_sets)
+
+
+# Looks up the sets of a workout, the history of an exercise, or an exercise from a workout, through the session's
+# query cache.
+
+def lookup_workout_sets(date=None,exercise=None,session=None):
+    session = session or get_session()
+    exercise_id = None if exercise is None else session.engine.exercise_ids.get(exercise)
+    if exercise is not None and exercise_id is None:
+        return []
+    
+    if exercise_id is None:
+        sql_statement = f'''SELECT {workout_set_columns} FROM WorkoutTable JOIN Exercise USING (ExerciseID)
+                            WHERE UserID=(:user_id) AND Date=(:date)
+                            GROUP BY ExerciseID,SetNumber;'''
+    elif date is None:
+        sql_statement = f'''SELECT {workout_set_columns} FROM WorkoutTable JOIN Exercise USING (ExerciseID)
+                            WHERE UserID=(:user_id) AND ExerciseID=(:exercise_id) ORDER BY Date;'''
+    else:
+        sql_statement = f'''SELECT {workout_set_columns} FROM WorkoutTable JOIN Exercise USING (ExerciseID)
+                            WHERE UserID=(:user_id) AND Date=(:date) AND ExerciseID=(:exercise_id);'''
+    parameters = {'user_id':session.user_id,'date':date,'exercise_id':exercise_id}
+    
+    return list(session.cached_query(('sets',date,exercise_id),
+                                     lambda: session.execute(sql_statement,parameters).fetchall()))
+
+
+# Streams the sets logged between start_date and end_date (both inclusive, open ended when None), optionally only of
+# the given exercises, ordered by date, exercise and set number. Sets are read page by page with keyset pagination:
+# every page is a fresh query starting after the last (Date, ExerciseID, SetNumber) of the previous page, served by a
+# range scan of WorkoutTableDateIndex, so memory stays constant however long the history is and no statement is left
+# open between pages, so a generator that is closed early (close(), or leaving a "with closing(...)" block) or
+# abandoned holds no cursor or lock on the database.
+
+def query_workout_sets(start_date=None,end_date=None,exercises=None,page_size=1000,session=None):
+    session = session or get_session()
+    conditions = ['WorkoutTable.UserID=(:user_id)','(Date,WorkoutTable.ExerciseID,SetNumber) > (:date,:exercise_id,:set_number)']
+    parameters = {'user_id':session.user_id,'date':start_date or '','exercise_id':-1,'set_number':-1}
+    if start_date is not None:
+        conditions.append('Date >= (:start_date)')
+        parameters['start_date'] = start_date
+    if end_date is not None:
+        conditions.append('Date <= (:end_date)')
+        parameters['end_date'] = end_date
+    if exercises is not None:
+        exercise_ids = sorted({session.engine.exercise_ids[exercise] for exercise in exercises
+                               if exercise in session.engine.exercise_ids})
+        if not exercise_ids:
+            return
+        conditions.append(f"WorkoutTable.ExerciseID IN ({','.join(map(str,exercise_ids))})")
+    sql_statement = f'''SELECT Date,Exercise.Name,SetNumber,Reps,Weight,WorkoutTable.ExerciseID
+                        FROM WorkoutTable JOIN Exercise USING (ExerciseID)
+                        WHERE {' AND '.join(conditions)}
+                        ORDER BY Date,WorkoutTable.ExerciseID,SetNumber LIMIT {int(page_size)};'''
+
+    while True:
+        cursor = session.execute(sql_statement,parameters)
+        try:
+            page = cursor.fetchall()
+        finally:
+            cursor.close()
+        for date, exercise, set_number, reps, weight, _ in page:
+            yield date, exercise, set_number, reps, weight
+        if len(page) < page_size:
+            return
+        parameters['date'], _, parameters['set_number'], _, _, parameters['exercise_id'] = page[-1]
+
+# Builds the WHERE clause and parameters that select a workout, an exercise from a workout, or a single set of a user.
+
+def workout_set_filter(date,exercise_id=None,set_number=None,user_id=DEFAULT_USER_ID):
+    conditions = ['UserID=(:user_id)','Date=(:date)']
+    parameters = {'user_id':user_id,'date':date}
+    if exercise_id is not None:
+        conditions.append('ExerciseID=(:exercise_id)')
+        parameters['exercise_id'] = exercise_id
+        if set_number is not None:
+            conditions.append('SetNumber=(:set_number)')
+            parameters['set_number'] = set_number
+    return ' AND '.join(conditions), parameters
+
+
+# Updates the reps and/or weight of a single set. Reps and weight do not change the number of sets, so the
+# WeeklyMuscleSets table is left as it is; only the tonnage and best estimated 1RM of the set's day and week change.
+
+def update_workout_set(date,exercise,set_number,reps=None,weight=None,session=None):
+    session = session or get_session()
+    exercise_id = session.engine.exercise_ids.get(exercise)
+    if exercise_id is None:
+        return 0
     
-    conn.commit()
-    conn.close()
+    assignments = []
+    where, parameters = workout_set_filter(date,exercise_id,set_number,session.user_id)
+    if reps is not None:
+        assignments.append('Reps=(:new_reps)')
+        parameters['new_reps'] = reps
+    if weight is not None:
+        assignments.append('Weight=(:new_weight)')
+        parameters['new_weight'] = weight
+    if not assignments:
+        return 0
+    
+    with session.transaction():
+        old_reps_weights = session.execute(f'SELECT Reps,Weight FROM WorkoutTable WHERE {where};',parameters).fetchall()
+        updated_sets = session.execute(f'''UPDATE WorkoutTable
+                                            SET {', '.join(assignments)}
+                                            WHERE {where};''',parameters).rowcount
+        tonnage_change = sum(set_tonnage(old_reps if reps is None else reps,old_weight if weight is None else weight)
+                             - set_tonnage(old_reps,old_weight) for old_reps,old_weight in old_reps_weights)
+        if updated_sets:
+            apply_workout_changes([(date,exercise_id,0,tonnage_change,None)],recompute_best=True,session=session)
+
+    return updated_sets
+
+
+# Deletes a workout, an exercise from a workout, or a single set, and subtracts exactly the deleted sets from
+# WeeklyMuscleSets and the volume rollups. Only the rows being deleted are read, so the cost grows with the rows
+# touched, not the week.
+
+def delete_workout_sets(date,exercise=None,set_number=None,session=None):
+    session = session or get_session()
+    exercise_id = None if exercise is None else session.engine.exercise_ids.get(exercise)
+    if exercise is not None and exercise_id is None:
+        return 0
+    
+    where, parameters = workout_set_filter(date,exercise_id,set_number,session.user_id)
+    
+    with session.transaction():
+        deleted_sets = session.execute(f'''SELECT Date,ExerciseID,COUNT(ExerciseID),TOTAL(Reps*Weight)
+                                            FROM WorkoutTable
+                                            WHERE {where}
+                                            GROUP BY Date,ExerciseID;''',parameters).fetchall()
+        session.execute(f'DELETE FROM WorkoutTable WHERE {where};',parameters)
+        apply_workout_changes([(date,exercise_id,-number_of_sets,-tonnage,None)
+                               for date,exercise_id,number_of_sets,tonnage in deleted_sets],
+                              recompute_best=True,session=session)
+
+    return sum(deleted[2] for deleted in deleted_sets)
 
-# Function that updates reps and weight in SQL; returns week number for use with the function responsible for
-# updating the WeeklyMuscleSets table.
 
-def update_reps_and_weight():
-    conn = sqlite3.connect('LiftAppTest42.db')
-    c = conn.cursor()
+# Function that updates reps and weight in SQL; returns the (ISO year, week number) of the updated workout.
 
+def update_reps_and_weight(session=None):
     date = input("What is the date of the workout you want to update? YYYY-MM-DD ")
-    week_number = int(datetime.strptime(date,'%Y-%m-%d').strftime('%V'))
+    iso_year, week_number = iso_week_of_date(date)
     exercise = input("What exercise do you want to update? ")
     set_number = int(input("What set number do you want to update? "))
     
@@ -461,42 +2008,21 @@ def update_reps_and_weight():
     while rw not in ('reps','weight','both'):
         rw = input("Do you want to update reps, weight, or both? ").strip().lower()
     
-    if rw == 'reps':
+    new_reps, new_weight = None, None
+    if rw in ('reps','both'):
         new_reps = int(input("How many reps? "))
-        sql_statement = '''UPDATE WorkoutTable 
-                            SET Reps=(:new_reps) 
-                            WHERE Date=(:date) AND Exercise=(:exercise) AND SetNumber=(:set_number);'''
-        parameters = {'new_reps':new_reps,'date':date,'exercise':exercise,'set_number':set_number}
-        c.execute(sql_statement,parameters)
-    elif rw == 'weight':
+    if rw in ('weight','both'):
         new_weight = float(input("How much weight? "))
-        sql_statement = '''UPDATE WorkoutTable 
-                            SET Weight=(:new_weight) 
-                            WHERE Date=(:date) AND Exercise=(:exercise) AND SetNumber=(:set_number);'''
-        parameters = {'new_weight':new_weight,'date':date,'exercise':exercise,'set_number':set_number}
-        c.execute(sql_statement,parameters)
-    else:
-        new_reps = int(input("How many reps? "))
-        new_weight = float(input("How much weight? "))
-        sql_statement = '''UPDATE WorkoutTable 
-                            SET Reps=(:new_reps), Weight=(:new_weight) 
-                            WHERE Date=(:date) AND Exercise=(:exercise) AND SetNumber=(:set_number);'''
-        parameters = {'new_reps':new_reps,'new_weight':new_weight,'date':date,'exercise':exercise,'set_number':set_number}
-        c.execute(sql_statement,parameters)
         
-    conn.commit()
-    conn.close()
+    update_workout_set(date,exercise,set_number,new_reps,new_weight,session)
         
-    return week_number
+    return iso_year, week_number
 
 
-# Function that can delete an entire workout, exercise, or a set based on user input; returns week number 
-# for use with the function responsible for updating the WeeklyMuscleSets table.
+# Function that can delete an entire workout, exercise, or a set based on user input; returns the (ISO year, week
+# number) of the workout the sets were deleted from.
 
-def delete():
-    conn = sqlite3.connect('LiftAppTest42.db')
-    c = conn.cursor()
-    
+def delete(session=None):
     delete_query = input('''Do you want to delete a workout, an exercise from a workout, 
                             or a specific set from a workout? (workout, exercise, set) ''').strip().lower()
     while delete_query not in ('workout','exercise','set'):
@@ -504,42 +2030,737 @@ def delete():
                                 or a specific set from a workout? (workout, exercise, set) ''').strip().lower()
         
     date = input("Please specify the workout date. YYYY-MM-DD ")
-    week_number = int(datetime.strptime(date,'%Y-%m-%d').strftime('%V'))
+    iso_year, week_number = iso_week_of_date(date)
+    exercise, set_number = None, None
     
-    if delete_query == 'workout':
-        
-        sql_statement = 'DELETE FROM WorkoutTable WHERE Date=(:date);'
-        c.execute(sql_statement,{'date':date})
-        
-    elif delete_query == 'exercise':
+    if delete_query == 'exercise':
         exercise = input("Please specify the exercise you wish to delete. ")
         
-        sql_statement = 'DELETE FROM WorkoutTable WHERE Date=(:date) AND Exercise=(:exercise);'
-        c.execute(sql_statement,{'date':date,'exercise':exercise})
-        
-    else:
+    elif delete_query == 'set':
         exercise = input("Please specify the exercise from the workout. ")
         set_number = int(input("Please specify the set number you wish to delete. "))
         
-        sql_statement = '''DELETE FROM WorkoutTable 
-                            WHERE Date=(:date) AND Exercise=(:exercise) AND SetNumber=(:set_number);'''
-        c.execute(sql_statement,{'date':date,'exercise':exercise,'set_number':set_number})
-        
-    conn.commit()
-    conn.close()
+    delete_workout_sets(date,exercise,set_number,session)
         
-    return week_number
+    return iso_year, week_number
 
 
-# Updates WeeklyMuscleSets after user updates reps and weight.
-def full_update():
-    week_number = update_reps_and_weight()
+# User updates reps and weight; WeeklyMuscleSets is unaffected by reps and weight.
+def full_update(session=None):
+    return update_reps_and_weight(session)
     
-    specific_weekly_muscle_sets_update_sql(week_number)
+# User deletes a workout, exercise, or set; "delete" already subtracts the deleted sets from WeeklyMuscleSets.
+def full_delete(session=None):
+    return delete(session)
+
+
+# In[15]:
+
+
+# Bulk import and export of workout history. Files hold one set per record, either as NDJSON (one JSON object per
+# line) or as CSV with a header row, using these fields.
+
+workout_record_fields = ('date','exercise','set_number','reps','weight')
+
+
+# Generator that streams the records of an NDJSON or CSV file one at a time.
+
+def read_workout_records(path):
+    with open(path,newline='') as file:
+        if path.lower().endswith('.csv'):
+            yield from csv.DictReader(file)
+        else:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+# Validates a single record against an exercise catalog and returns its (date, exercise, set number, reps, weight).
+# Reps and weight may be missing, null or empty (as export_workout_history writes NULLs), and are then None. Numbers
+# must fit the columns of a WorkoutBatch.
+
+def parse_workout_record(record,engine=None):
+    engine = engine or get_session().engine
+    date = str(record['date'])
+    if len(date) != 10:
+        raise ValueError(f'Dates must be in YYYY-MM-DD format: {date!r}')
+    ordinal_of_date(date)
+    exercise = record['exercise']
+    if exercise not in engine.exercise_ids:
+        raise ValueError(f'Unknown exercise: {exercise!r}')
+    set_number = int(record['set_number'])
+    if not 0 <= set_number <= 0xFFFF:
+        raise ValueError(f'Set numbers must be between 0 and {0xFFFF}: {set_number!r}')
+    reps, weight = record.get('reps'), record.get('weight')
+    reps = None if reps in (None,'') else int(reps)
+    if reps is not None and not 0 <= reps < WorkoutBatch.missing_reps:
+        raise ValueError(f'Reps must be between 0 and {WorkoutBatch.missing_reps - 1}: {reps!r}')
+    weight = None if weight in (None,'') else float(weight)
+    if weight is not None and not np.isfinite(weight):
+        raise ValueError(f'Weights must be finite numbers: {weight!r}')
+    return (date,exercise,set_number,reps,weight)
+
+
+# Generator that validates a stream of records and yields (record number, row) pairs. Invalid records either stop
+# the import or, with skip_invalid, are yielded with a row of None so they can be counted and skipped.
+
+def validated_workout_rows(records,first_record_number=1,skip_invalid=False,engine=None):
+    engine = engine or get_session().engine
+    for record_number,record in enumerate(records,start=first_record_number):
+        try:
+            yield record_number, parse_workout_record(record,engine)
+        except KeyError as error:
+            if not skip_invalid:
+                raise ValueError(f'Record {record_number}: missing field {error.args[0]!r}') from None
+            yield record_number, None
+        except (TypeError, ValueError) as error:
+            if not skip_invalid:
+                raise ValueError(f'Record {record_number}: {error}') from None
+            yield record_number, None
+
+
+# Imports an NDJSON or CSV file of sets without ever holding more than one chunk (a WorkoutBatch) in memory. Every
+# chunk is written to WorkoutTable and WeeklyMuscleSets together with the import checkpoint in one transaction, so re-running an
+# interrupted import resumes after the last committed chunk (restart=True starts over). Chunks are ingested without
+# replacing, as a workout may span chunks, so importing a file again only writes the sets that changed. Returns the
+# import stats.
+
+def import_workout_history(path,chunk_size=5000,skip_invalid=False,restart=False,session=None):
+    session = session or get_session()
+    source = os.path.abspath(path)
+    
+    if restart:
+        with session.transaction():
+            session.execute('DELETE FROM ImportCheckpoint WHERE UserID=(?) AND Source=(?);',(session.user_id,source))
+    checkpoint = session.execute('SELECT RecordsDone FROM ImportCheckpoint WHERE UserID=(?) AND Source=(?);',
+                                 (session.user_id,source)).fetchone()
+    records_done = checkpoint[0] if checkpoint else 0
     
-# Updates WeeklyMuscleSets after user deletes a workout, exercise, or set.
-def full_delete():
-    week_number = delete()
+    started = time.perf_counter()
+    rows_imported, records_skipped = 0, 0
+    records = islice(read_workout_records(path),records_done,None)
+    rows = validated_workout_rows(records,records_done + 1,skip_invalid,session.engine)
     
-    specific_weekly_muscle_sets_update_sql(week_number)
+    while True:
+        batch = WorkoutBatch(session.engine)
+        last_record_number = None
+        for record_number,row in islice(rows,chunk_size):
+            last_record_number = record_number
+            if row is None:
+                records_skipped += 1
+            else:
+                batch.append(*row)
+        if last_record_number is None:
+            break
+        
+        with session.transaction():
+            ingest_workout_batch(batch,replace=False,session=session)
+            session.execute('''INSERT INTO ImportCheckpoint (UserID, Source, RecordsDone) VALUES (?, ?, ?)
+                               ON CONFLICT (UserID, Source) DO UPDATE SET RecordsDone = excluded.RecordsDone;''',
+                            (session.user_id,source,last_record_number))
+            
+        rows_imported += len(batch)
+        
+    seconds = time.perf_counter() - started
+    stats = {'rows':rows_imported,'skipped':records_skipped,'resumed_after':records_done,'seconds':seconds,
+             'rows_per_second':rows_imported/seconds if seconds else 0.0}
+    return stats
+
 
+# Exports the sets of the session's user to an NDJSON or CSV file. Rows are stepped through the cursor in batches instead of being
+# loaded with fetchall(), so memory stays flat however long the history is. Returns the export stats.
+
+def export_workout_history(path,batch_size=5000,session=None):
+    session = session or get_session()
+    
+    started = time.perf_counter()
+    rows_exported = 0
+    cursor = session.execute(f'''SELECT {workout_set_columns} 
+                                 FROM WorkoutTable JOIN Exercise USING (ExerciseID) 
+                                 WHERE UserID=(?)
+                                 ORDER BY Date,ExerciseID,SetNumber;''',(session.user_id,))
+    
+    with open(path,'w',newline='') as file:
+        if path.lower().endswith('.csv'):
+            writer = csv.writer(file)
+            writer.writerow(workout_record_fields)
+            write_rows = writer.writerows
+        else:
+            def write_rows(rows):
+                file.writelines(json.dumps(dict(zip(workout_record_fields,row))) + '\n' for row in rows)
+        
+        for rows in iter(lambda: cursor.fetchmany(batch_size),[]):
+            write_rows(rows)
+            rows_exported += len(rows)
+            
+    seconds = time.perf_counter() - started
+    stats = {'rows':rows_exported,'seconds':seconds,
+             'rows_per_second':rows_exported/seconds if seconds else 0.0}
+    return stats
+
+
+# Columnar snapshots of a user's history for analysis and plotting. A snapshot is a directory holding one binary
+# file per column of WorkoutTable and WeeklyMuscleSets, in the dtypes below, and a header.json with the format
+# version, the snapshot version, the row count of each table, the exercise and muscle dictionaries and the high-water
+# mark: the largest WorkoutTable rowid in the snapshot. Sets are stored in rowid order, so refreshing a snapshot only
+# appends the sets logged after the high-water mark. Updating or deleting a set that is already in the snapshot
+# changes the fingerprint of the snapshotted rows (their count and the sum of a hash of every column and the rowid
+# of each row), and the snapshot is then written again in full. This also catches a set deleted and replaced by one
+# reusing its rowid. WeeklyMuscleSets has one row per week and is always written in full. As in a WorkoutBatch,
+# missing reps are stored as WorkoutBatch.missing_reps and missing weights as NaN.
+
+snapshot_format_version = 2
+
+snapshot_row_hash_sql = 'rowid % 2147483647'
+for hashed_column in ("CAST(REPLACE(Date,'-','') AS INTEGER)",'ExerciseID','SetNumber','IFNULL(Reps,-1)',
+                      'IFNULL(CAST(ROUND(Weight*1000) AS INTEGER),-1)'):
+    snapshot_row_hash_sql = f'(({snapshot_row_hash_sql})*1000003 + {hashed_column}) % 2147483647'
+
+workout_snapshot_columns = {'Date':'datetime64[D]','ExerciseID':'int32','SetNumber':'uint16','Reps':'uint16',
+                            'Weight':'float32'}
+weekly_snapshot_columns = dict({'IsoYear':'int16','WeekID':'int16'},**{muscle:'float32' for muscle in muscle_names})
+
+def snapshot_column_path(directory,table,column):
+    return Path(directory) / f'{table}.{column}.bin'
+
+def read_snapshot_header(directory):
+    try:
+        with open(Path(directory) / 'header.json') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+# Files are written under a temporary name and then renamed over the old ones, so a reader that has the old file
+# mapped keeps a consistent copy; the header is renamed last and is what makes a refresh visible.
+
+def replace_snapshot_file(path,write):
+    temporary_path = path.with_name(path.name + '.tmp')
+    with open(temporary_path,'wb') as file:
+        write(file)
+    os.replace(temporary_path,path)
+
+def write_snapshot_columns(files,columns,rows):
+    for file,values,dtype in zip(files,zip(*rows),columns.values()):
+        np.asarray(values,dtype=dtype).tofile(file)
+
+
+# Writes a columnar snapshot of the session's user into "directory", or brings an existing one up to date by
+# appending the sets logged since it was written. Returns the new header.
+
+def write_columnar_snapshot(directory,batch_size=50000,session=None):
+    session = session or get_session()
+    directory = Path(directory)
+    directory.mkdir(parents=True,exist_ok=True)
+    header = read_snapshot_header(directory)
+
+    high_water_mark = session.execute('SELECT COALESCE(MAX(rowid),0) FROM WorkoutTable WHERE UserID=(?);',
+                                      (session.user_id,)).fetchone()[0]
+    fingerprint_statement = f'''SELECT COUNT(*),IFNULL(SUM({snapshot_row_hash_sql}),0) FROM WorkoutTable
+                                WHERE UserID=(?) AND rowid<=(?);'''
+    appending = (header is not None and header['format_version'] == snapshot_format_version
+                 and header['user_id'] == session.user_id and header['high_water_mark'] <= high_water_mark
+                 and list(session.execute(fingerprint_statement,
+                                          (session.user_id,header['high_water_mark'])).fetchone()) == header['fingerprint'])
+    first_rowid = header['high_water_mark'] if appending else 0
+    rows = header['tables']['WorkoutTable']['rows'] if appending else 0
+
+    cursor = session.execute(f'''SELECT Date,ExerciseID,SetNumber,IFNULL(Reps,{WorkoutBatch.missing_reps}),Weight
+                                 FROM WorkoutTable WHERE UserID=(?) AND rowid>(?) AND rowid<=(?) ORDER BY rowid;''',
+                             (session.user_id,first_rowid,high_water_mark))
+    paths = [snapshot_column_path(directory,'WorkoutTable',column) for column in workout_snapshot_columns]
+    if appending:
+        files = [open(path,'r+b') for path in paths]
+        for file,dtype in zip(files,workout_snapshot_columns.values()):
+            file.truncate(rows*np.dtype(dtype).itemsize)
+            file.seek(0,os.SEEK_END)
+    else:
+        files = [open(path.with_name(path.name + '.tmp'),'wb') for path in paths]
+    try:
+        for batch in iter(lambda: cursor.fetchmany(batch_size),[]):
+            write_snapshot_columns(files,workout_snapshot_columns,batch)
+            rows += len(batch)
+    finally:
+        for file in files:
+            file.close()
+    if not appending:
+        for path in paths:
+            os.replace(path.with_name(path.name + '.tmp'),path)
+
+    weekly_rows = session.execute(f'''SELECT IsoYear,WeekID,{','.join(muscle_names)} FROM WeeklyMuscleSets
+                                      WHERE UserID=(?) ORDER BY IsoYear,WeekID;''',(session.user_id,)).fetchall()
+    weekly_columns = list(zip(*weekly_rows)) or [()]*len(weekly_snapshot_columns)
+    for (column,dtype),values in zip(weekly_snapshot_columns.items(),weekly_columns):
+        replace_snapshot_file(snapshot_column_path(directory,'WeeklyMuscleSets',column),
+                              np.asarray(values,dtype=dtype).tofile)
+
+    header = {'format_version':snapshot_format_version,
+              'version':(header['version'] + 1) if header is not None else 1,
+              'user_id':session.user_id,
+              'high_water_mark':high_water_mark,
+              'fingerprint':list(session.execute(fingerprint_statement,(session.user_id,high_water_mark)).fetchone()),
+              'exercises':[[int(exercise_id),exercise] for exercise,exercise_id in session.engine.exercise_ids.items()],
+              'muscles':[[int(muscle_id),muscle] for muscle_id,muscle in zip(session.engine.muscle_ids,muscle_names)],
+              'tables':{'WorkoutTable':{'rows':rows,'columns':workout_snapshot_columns},
+                        'WeeklyMuscleSets':{'rows':len(weekly_rows),'columns':weekly_snapshot_columns}}}
+    replace_snapshot_file(directory / 'header.json',lambda file: file.write(json.dumps(header,indent=1).encode()))
+    return header
+
+
+# A columnar snapshot opened for reading. Every column is a read-only numpy.memmap of its file, sized by the header,
+# so opening a snapshot reads nothing but the header and the pages that are actually used are loaded on demand.
+# "workout_sets" and "weekly_muscle_sets" map column names to arrays; Date is a datetime64[D] array.
+
+class ColumnarSnapshot:
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.header = read_snapshot_header(self.directory)
+        if self.header is None:
+            raise FileNotFoundError(f'No columnar snapshot in {self.directory}')
+        if self.header['format_version'] != snapshot_format_version:
+            raise ValueError(f"Unsupported snapshot format version: {self.header['format_version']}")
+        self.exercise_names = {exercise_id: exercise for exercise_id,exercise in self.header['exercises']}
+        self.exercise_ids = {exercise: exercise_id for exercise_id,exercise in self.header['exercises']}
+        self.workout_sets = self.open_table('WorkoutTable')
+        self.weekly_muscle_sets = self.open_table('WeeklyMuscleSets')
+
+    def open_table(self, table):
+        rows = self.header['tables'][table]['rows']
+        return {column: (np.memmap(snapshot_column_path(self.directory,table,column),dtype=dtype,mode='r',shape=(rows,))
+                         if rows else np.zeros(0,dtype=dtype))
+                for column,dtype in self.header['tables'][table]['columns'].items()}
+
+    # Boolean mask of the sets of an exercise, to select from the workout_sets columns.
+    def exercise_mask(self, exercise):
+        return self.workout_sets['ExerciseID'] == self.exercise_ids.get(exercise,-1)
+
+
+# In[16]:
+
+
+# Compares the nested workout dictionary with a WorkoutBatch holding the same synthetic sets: the memory each one
+# takes (traced with tracemalloc) and the time it takes to ingest each one into an in-memory database.
+
+def measure_workout_batch_footprint(number_of_sets=100000,sets_per_exercise=4,exercises_per_workout=10):
+    exercises = tuple(exercise_list)
+    sets_per_workout = sets_per_exercise*exercises_per_workout
+    first_ordinal = ordinal_of_date('2015-01-05')
+    dates = [date_of_ordinal(first_ordinal + day) for day in range(number_of_sets//sets_per_workout + 1)]
+    
+    def synthetic_sets():
+        for i in range(number_of_sets):
+            yield (dates[i//sets_per_workout],exercises[(i//sets_per_exercise) % len(exercises)],
+                   i % sets_per_exercise + 1,5 + i % 6,60.0 + i % 50)
+    
+    tracemalloc.start()
+    workout_dictionary = {}
+    for date,exercise,set_number,reps,weight in synthetic_sets():
+        workout_dictionary.setdefault(date,{}).setdefault(exercise,{})[set_number] = {'reps':reps,'weight':weight}
+    nested_dictionary_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    
+    catalog_session = LyfterSession(':memory:')
+    create_lyfter_tables(catalog_session)
+    tracemalloc.start()
+    batch = WorkoutBatch(catalog_session.engine)
+    for workout_set in synthetic_sets():
+        batch.append(*workout_set)
+    workout_batch_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    catalog_session.close()
+    
+    ingest_seconds = {}
+    for name,ingest in (('nested_dictionary',lambda session: (update_muscle_sets_in_sql_from_py(workout_dictionary,session),
+                                                              update_workout_table_in_sql_from_py(workout_dictionary,session))),
+                        ('workout_batch',lambda session: write_workout_batch(batch,session))):
+        session = LyfterSession(':memory:')
+        create_lyfter_tables(session)
+        started = time.perf_counter()
+        with session.transaction():
+            ingest(session)
+        ingest_seconds[name] = time.perf_counter() - started
+        session.close()
+    
+    return {'sets':number_of_sets,
+            'nested_dictionary_bytes':nested_dictionary_bytes,
+            'workout_batch_bytes':workout_batch_bytes,
+            'nested_dictionary_ingest_seconds':ingest_seconds['nested_dictionary'],
+            'workout_batch_ingest_seconds':ingest_seconds['workout_batch']}
+
+
+# Seeded generator of realistic workout histories for benchmarks. Every user follows a program of "day templates"
+# drawn from "exercise_list", trains "sessions_per_week" days a week and slowly progresses the weight of every
+# exercise, with fewer reps on later sets. Yields one workout at a time as (user ID, date, [(exercise, set number,
+# reps, weight), ...]), in date order per user; the same seed always gives the same history.
+
+def synthetic_workouts(users=1,years=1,sessions_per_week=4,exercises_per_session=5,sets_per_exercise=4,seed=0,
+                       start_date='2020-01-06'):
+    exercises = tuple(exercise_list)
+    first_ordinal = ordinal_of_date(start_date)
+    for user_id in range(1,users + 1):
+        rng = random.Random(f'{seed}:{user_id}')
+        templates = [rng.sample(exercises,exercises_per_session) for template in range(max(sessions_per_week,1))]
+        start_weights = {exercise:rng.randrange(8,60)*2.5 for exercise in exercises}
+        target_reps = {exercise:rng.choice((3,5,6,8,10,12)) for exercise in exercises}
+        for week in range(years*52):
+            training_days = sorted(rng.sample(range(7),min(sessions_per_week,7)))
+            for template,weekday in zip(templates,training_days):
+                workout_date = date_of_ordinal(first_ordinal + week*7 + weekday)
+                workout_sets = []
+                for exercise in template:
+                    weight = round(start_weights[exercise]*(1 + 0.004*week)*rng.uniform(0.95,1.05)/2.5)*2.5
+                    for set_number in range(1,sets_per_exercise + 1):
+                        reps = max(1,target_reps[exercise] - (set_number - 1)//2 + rng.randint(-1,1))
+                        workout_sets.append((exercise,set_number,reps,weight))
+                yield user_id, workout_date, workout_sets
+
+
+# Times every call of "operation" over "samples" and summarizes them: calls, rows handled (as returned by each call),
+# rows/s, p50 and p99 latency in milliseconds and, while tracemalloc is tracing, the peak of Python memory allocated
+# during the calls. SQLite's own memory is not traced.
+
+def benchmark_operation(operation,samples):
+    latencies, rows = [], 0
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+        memory_before = tracemalloc.get_traced_memory()[0]
+    for sample in samples:
+        started = time.perf_counter()
+        rows += operation(sample) or 0
+        latencies.append(time.perf_counter() - started)
+    seconds = sum(latencies)
+    milliseconds = np.asarray(latencies)*1000 if latencies else np.zeros(1)
+    return {'calls':len(latencies),
+            'rows':rows,
+            'seconds':seconds,
+            'rows_per_second':rows/seconds if seconds else 0.0,
+            'p50_ms':float(np.percentile(milliseconds,50)),
+            'p99_ms':float(np.percentile(milliseconds,99)),
+            'peak_memory_bytes':(tracemalloc.get_traced_memory()[1] - memory_before
+                                 if tracemalloc.is_tracing() else None)}
+
+
+# Benchmarks the core operations on a synthetic history of users x years x sessions per week x exercises per session
+# x sets per exercise sets, and returns the results as a JSON-ready dictionary (also written to "output_path" if
+# given). Workouts are ingested one at a time: first into WorkoutTable, then as an incremental WeeklyMuscleSets update
+# and an incremental volume rollup update. The queries then run "samples" times each on random users, weeks, dates
+# and exercises, followed by single-set updates and deletes (update_workout_set and delete_workout_sets, the
+# non-interactive core of update_reps_and_weight and delete) each followed by specific_weekly_muscle_sets_update_sql.
+# The query cache is disabled so every query reaches SQLite. With trace_memory=True, peak Python memory is traced per
+# operation; tracing slows down Python-heavy operations considerably, so only compare runs with the same setting.
+
+def benchmark_lyfter(users=2,years=2,sessions_per_week=4,exercises_per_session=5,sets_per_exercise=4,samples=200,
+                     seed=0,db_path=':memory:',trace_memory=True,output_path=None):
+    rng = random.Random(seed)
+    session = LyfterSession(db_path,query_cache=QueryCache(max_entries=0))
+    create_lyfter_tables(session)
+    engine = session.engine
+    operations = {}
+    if trace_memory:
+        tracemalloc.start()
+
+    workouts = []
+    for user_id,workout_date,workout_sets in synthetic_workouts(users,years,sessions_per_week,exercises_per_session,
+                                                                sets_per_exercise,seed):
+        batch = WorkoutBatch(engine)
+        for workout_set in workout_sets:
+            batch.append(workout_date,*workout_set)
+        workouts.append((user_id,workout_date,batch))
+
+    def insert_workout(workout):
+        user_id, workout_date, batch = workout
+        with session.transaction():
+            session.executemany(insert_workout_set_statement,batch.rows(user_id))
+        return len(batch)
+
+    def update_weekly_muscle_sets(workout):
+        user_id, workout_date, batch = workout
+        apply_weekly_muscle_set_changes(batch.workout_changes(),session.for_user(user_id))
+        return len(batch)
+
+    def update_volume_rollups(workout):
+        user_id, workout_date, batch = workout
+        apply_volume_changes(batch.workout_changes(),session=session.for_user(user_id))
+        return len(batch)
+
+    def update_daily_muscle_sets(workout):
+        user_id, workout_date, batch = workout
+        apply_daily_muscle_set_changes(batch.workout_changes(),session.for_user(user_id))
+        return len(batch)
+
+    operations['workout_table_insert'] = benchmark_operation(insert_workout,workouts)
+    operations['weekly_muscle_sets_incremental_update'] = benchmark_operation(update_weekly_muscle_sets,workouts)
+    operations['volume_rollups_incremental_update'] = benchmark_operation(update_volume_rollups,workouts)
+    operations['daily_muscle_sets_incremental_update'] = benchmark_operation(update_daily_muscle_sets,workouts)
+
+    number_of_sets = session.execute('SELECT COUNT(*) FROM WorkoutTable;').fetchone()[0]
+    operations['full_weekly_rebuild'] = benchmark_operation(
+        lambda sample: update_all_weekly_muscle_sets_in_sql(session) or number_of_sets,range(5))
+
+    sampled_workouts = [rng.choice(workouts) for sample in range(samples)]
+    sampled_weeks = [(user_id,*iso_week_of_date(workout_date)) for user_id,workout_date,batch in sampled_workouts]
+    sampled_exercises = [(user_id,workout_date,engine.exercise_names[rng.choice(batch.exercise_ids)])
+                         for user_id,workout_date,batch in sampled_workouts]
+
+    operations['get_weekly_muscle_sets_from_sql_workout_table'] = benchmark_operation(
+        lambda week: len(get_weekly_muscle_sets_from_sql_workout_table(week[2],week[1],session.for_user(week[0]))),
+        sampled_weeks)
+    operations['read_workout'] = benchmark_operation(
+        lambda sample: len(lookup_workout_sets(sample[1],session=session.for_user(sample[0]))),sampled_exercises)
+    operations['read_exercise'] = benchmark_operation(
+        lambda sample: len(lookup_workout_sets(exercise=sample[2],session=session.for_user(sample[0]))),
+        sampled_exercises)
+    operations['read_workout_exercise'] = benchmark_operation(
+        lambda sample: len(lookup_workout_sets(sample[1],sample[2],session.for_user(sample[0]))),sampled_exercises)
+    operations['acute_chronic_workload'] = benchmark_operation(
+        lambda sample: len(get_acute_chronic_workload(sample[1],session=session.for_user(sample[0]))),sampled_exercises)
+
+    set_rowids = rng.sample(range(1,number_of_sets + 1),min(2*samples,number_of_sets))
+    sampled_sets = [session.execute('SELECT UserID,Date,ExerciseID,SetNumber,IsoYear,IsoWeek FROM WorkoutTable '
+                                    'WHERE rowid=(?);',(rowid,)).fetchone() for rowid in set_rowids]
+
+    def update_and_refresh_week(workout_set):
+        user_id, workout_date, exercise_id, set_number, iso_year, iso_week = workout_set
+        user_session = session.for_user(user_id)
+        updated_sets = update_workout_set(workout_date,engine.exercise_names[exercise_id],set_number,
+                                          rng.randint(1,12),rng.randrange(8,80)*2.5,user_session)
+        specific_weekly_muscle_sets_update_sql(iso_week,iso_year,user_session)
+        return updated_sets
+
+    def delete_and_refresh_week(workout_set):
+        user_id, workout_date, exercise_id, set_number, iso_year, iso_week = workout_set
+        user_session = session.for_user(user_id)
+        deleted_sets = delete_workout_sets(workout_date,engine.exercise_names[exercise_id],set_number,user_session)
+        specific_weekly_muscle_sets_update_sql(iso_week,iso_year,user_session)
+        return deleted_sets
+
+    operations['update_reps_and_weight'] = benchmark_operation(update_and_refresh_week,sampled_sets[:samples])
+    operations['delete'] = benchmark_operation(delete_and_refresh_week,sampled_sets[samples:])
+
+    if trace_memory:
+        tracemalloc.stop()
+    session.close()
+
+    results = {'config':{'users':users,'years':years,'sessions_per_week':sessions_per_week,
+                         'exercises_per_session':exercises_per_session,'sets_per_exercise':sets_per_exercise,
+                         'samples':samples,'seed':seed,'db_path':db_path,'trace_memory':trace_memory},
+               'environment':{'python':platform.python_version(),'sqlite':sqlite3.sqlite_version,
+                              'numpy':np.__version__,'machine':platform.machine()},
+               'sets':number_of_sets,
+               'operations':operations}
+    if output_path is not None:
+        with open(output_path,'w') as file:
+            json.dump(results,file,indent=2)
+    return results
+
+
+# Compares two benchmark result files operation by operation: the ratio of current to baseline rows/s and p99
+# latency. Rows/s below 1.0 or p99 above 1.0 is a slowdown.
+
+def compare_benchmark_results(baseline_path,current_path):
+    with open(baseline_path) as file:
+        baseline = json.load(file)['operations']
+    with open(current_path) as file:
+        current = json.load(file)['operations']
+    comparison = {}
+    for operation in baseline:
+        if operation not in current:
+            continue
+        old, new = baseline[operation], current[operation]
+        comparison[operation] = {'rows_per_second':new['rows_per_second']/old['rows_per_second']
+                                                   if old['rows_per_second'] else None,
+                                 'p99_ms':new['p99_ms']/old['p99_ms'] if old['p99_ms'] else None}
+    return comparison
+
+
+# In[17]:
+
+
+# Lyfter as a local service, so many clients can log and look up workouts against one database at once. Clients
+# connect over a Unix socket or local TCP and send one JSON request per line, answered by one JSON line each:
+#
+#   {"id": 1, "op": "log", "user_id": 7, "sets": [{"date": "2024-05-06", "exercise": "Back Squat", "set_number": 1,
+#                                                  "reps": 5, "weight": 100.0}, ...]}
+#   {"id": 2, "op": "read", "user_id": 7, "date": "2024-05-06", "exercise": "Back Squat"}
+#   {"id": 3, "op": "update", "user_id": 7, "date": "2024-05-06", "exercise": "Back Squat", "set_number": 1, "reps": 6}
+#   {"id": 4, "op": "delete", "user_id": 7, "date": "2024-05-06", "exercise": "Back Squat", "set_number": 1}
+#   {"id": 5, "op": "ingest", "user_id": 7, "replace": true, "sets": [...]}
+#
+#   -> {"id": 1, "ok": true, "result": 1} or {"id": 1, "ok": false, "error": "Unknown exercise: 'Back Squats'"}
+#
+# "log" adds sets and fails on sets that are already stored; "ingest" takes whole workouts and can be retried safely
+# (see ingest_workout_batch).
+#
+# Only one connection ever writes. Write requests are queued for a single writer task, which waits "commit_window"
+# seconds after the first request, then runs everything queued (up to "max_batch" requests) in one transaction, each
+# request in its own savepoint, and commits once. Reads run on a pool of threads, each with its own read-only
+# connection; in WAL mode they never wait for the writer. Reader connections do not see the writer's query cache
+# invalidations, so they do not cache.
+
+service_pragmas = dict(session_pragmas, busy_timeout=5000)
+
+class LyfterService:
+    def __init__(self, db_path=None, reader_threads=4, commit_window=0.002, max_batch=1000):
+        self.db_path = DATABASE_PATH if db_path is None else db_path
+        self.commit_window = commit_window
+        self.max_batch = max_batch
+        self.reader_threads = reader_threads
+        self.writer_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='lyfter-writer')
+        self.reader_executor = ThreadPoolExecutor(max_workers=reader_threads, thread_name_prefix='lyfter-reader')
+        self.readers = threading.local()
+        self.writer_session = None
+        self.write_queue = None
+        self.writer_task = None
+        self.commits = 0
+
+    # Opens the writer connection, creates the tables if needed and starts the writer task. Must run inside the
+    # event loop that serves the clients.
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.writer_executor,self._open_writer_session)
+        self.write_queue = asyncio.Queue()
+        self.writer_task = asyncio.create_task(self._write_batches())
+
+    async def stop(self):
+        if self.writer_task is not None:
+            self.writer_task.cancel()
+            try:
+                await self.writer_task
+            except asyncio.CancelledError:
+                pass
+        # The writer connection is closed last: the last connection to close checkpoints the WAL and removes it,
+        # which read-only connections cannot do.
+        loop = asyncio.get_running_loop()
+        barrier = threading.Barrier(self.reader_threads)
+        await asyncio.gather(*(loop.run_in_executor(self.reader_executor,self._close_reader_session,barrier)
+                               for reader_thread in range(self.reader_threads)))
+        self.reader_executor.shutdown()
+        await loop.run_in_executor(self.writer_executor,self.writer_session.close)
+        self.writer_executor.shutdown()
+
+    def _open_writer_session(self):
+        self.writer_session = LyfterSession(self.db_path,pragmas=service_pragmas,query_cache=QueryCache(max_entries=0))
+        create_lyfter_tables(self.writer_session)
+
+    def _reader_session(self):
+        session = getattr(self.readers,'session',None)
+        if session is None:
+            session = self.readers.session = LyfterSession(self.db_path,pragmas=service_pragmas,
+                                                           query_cache=QueryCache(max_entries=0),read_only=True)
+        return session
+
+    # Connections can only be closed on the thread that opened them. Every reader thread runs this once: the barrier
+    # holds each thread until all of them have picked up a call.
+    def _close_reader_session(self, barrier):
+        session = getattr(self.readers,'session',None)
+        if session is not None:
+            self.readers.session = None
+            session.close()
+        barrier.wait()
+
+    async def handle_request(self, request):
+        op = request.get('op')
+        if op in ('log','ingest','update','delete'):
+            future = asyncio.get_running_loop().create_future()
+            await self.write_queue.put((request,future))
+            return await future
+        if op == 'read':
+            return await asyncio.get_running_loop().run_in_executor(self.reader_executor,self._read,request)
+        raise ValueError(f'Unknown op: {op!r}')
+
+    def _read(self, request):
+        session = self._reader_session().for_user(request.get('user_id',DEFAULT_USER_ID))
+        return [list(row) for row in lookup_workout_sets(request.get('date'),request.get('exercise'),session)]
+
+    async def _write_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.write_queue.get()]
+            await asyncio.sleep(self.commit_window)
+            while len(batch) < self.max_batch and not self.write_queue.empty():
+                batch.append(self.write_queue.get_nowait())
+            try:
+                results = await loop.run_in_executor(self.writer_executor,self._commit_batch,
+                                                     [request for request,future in batch])
+            except Exception as error:
+                results = [error]*len(batch)
+            for (request,future),result in zip(batch,results):
+                if future.done():
+                    continue
+                if isinstance(result,Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    # Runs on the writer thread: every request of a batch in its own savepoint, so a failing request does not undo
+    # the others, and a single commit for all of them.
+    def _commit_batch(self, requests):
+        session = self.writer_session
+        results = []
+        with session.transaction():
+            for request in requests:
+                try:
+                    with session.transaction():
+                        results.append(self._write(session.for_user(request.get('user_id',DEFAULT_USER_ID)),request))
+                except Exception as error:
+                    results.append(error)
+        self.commits += 1
+        return results
+
+    def _write(self, session, request):
+        op = request['op']
+        if op in ('log','ingest'):
+            batch = WorkoutBatch(session.engine)
+            for record in request['sets']:
+                batch.append(*parse_workout_record(record,session.engine))
+            if op == 'ingest':
+                return ingest_workout_batch(batch,request.get('replace',True),session)
+            write_workout_batch(batch,session)
+            return len(batch)
+        if op == 'update':
+            return update_workout_set(request['date'],request['exercise'],request['set_number'],
+                                      request.get('reps'),request.get('weight'),session)
+        return delete_workout_sets(request['date'],request.get('exercise'),request.get('set_number'),session)
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                request_id = None
+                try:
+                    request = json.loads(line)
+                    request_id = request.get('id')
+                    response = {'id':request_id,'ok':True,'result':await self.handle_request(request)}
+                except Exception as error:
+                    response = {'id':request_id,'ok':False,'error':str(error)}
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+        finally:
+            writer.close()
+
+    # Serves clients until cancelled, on a Unix socket if "unix_path" is given and on local TCP otherwise. The listen
+    # backlog is raised so hundreds of clients can connect at once.
+    async def serve(self, host='127.0.0.1', port=8765, unix_path=None):
+        await self.start()
+        try:
+            if unix_path is not None:
+                server = await asyncio.start_unix_server(self.handle_client,path=unix_path,limit=2**24,
+                                                         backlog=1024)
+            else:
+                server = await asyncio.start_server(self.handle_client,host,port,limit=2**24,backlog=1024)
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.stop()
+
+
+# Runs the service in the foreground until interrupted.
+
+def run_lyfter_service(db_path=None, host='127.0.0.1', port=8765, unix_path=None):
+    try:
+        asyncio.run(LyfterService(db_path).serve(host,port,unix_path))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,29 @@
+import runpy
+from pathlib import Path
+
+import pytest
+
+APPLICATION_PATH = Path(__file__).resolve().parent.parent / 'Lyfter Application (Updated).py'
+
+
+@pytest.fixture(scope='session')
+def lyfter():
+    return runpy.run_path(str(APPLICATION_PATH), run_name='lyfter')
+
+
+@pytest.fixture
+def session(lyfter):
+    session = lyfter['LyfterSession'](':memory:')
+    lyfter['create_lyfter_tables'](session)
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def write_sets(lyfter, session):
+    def write_sets(sets):
+        batch = lyfter['WorkoutBatch'](session.engine)
+        for workout_set in sets:
+            batch.append(*workout_set)
+        lyfter['write_workout_batch'](batch, session)
+    return write_sets
@@ -0,0 +1,36 @@
+import numpy as np
+
+
+def test_refresh_rewrites_a_set_replaced_under_the_same_rowid(lyfter, session, write_sets, tmp_path):
+    write_sets([('2024-01-01', 'Back Squat', 1, 5, 100.0), ('2024-01-02', 'Deadlift', 1, 5, 140.0)])
+    lyfter['write_columnar_snapshot'](tmp_path, session=session)
+
+    lyfter['delete_workout_sets']('2024-01-02', 'Deadlift', 1, session=session)
+    write_sets([('2024-01-02', 'Romanian Deadlift', 1, 5, 140.0)])
+    header = lyfter['write_columnar_snapshot'](tmp_path, session=session)
+
+    snapshot = lyfter['ColumnarSnapshot'](tmp_path)
+    stored_exercise_ids = session.execute('SELECT ExerciseID FROM WorkoutTable ORDER BY rowid;').fetchall()
+    assert header['version'] == 2
+    assert snapshot.workout_sets['ExerciseID'].tolist() == [row[0] for row in stored_exercise_ids]
+
+
+def test_refresh_appends_new_sets(lyfter, session, write_sets, tmp_path):
+    write_sets([('2024-01-01', 'Back Squat', 1, 5, 100.0)])
+    lyfter['write_columnar_snapshot'](tmp_path, session=session)
+    write_sets([('2024-01-03', 'Back Squat', 1, 5, 105.0)])
+    lyfter['write_columnar_snapshot'](tmp_path, session=session)
+
+    snapshot = lyfter['ColumnarSnapshot'](tmp_path)
+    assert [str(day) for day in snapshot.workout_sets['Date']] == ['2024-01-01', '2024-01-03']
+    assert snapshot.workout_sets['Weight'].tolist() == [100.0, 105.0]
+
+
+def test_snapshot_keeps_large_set_numbers_and_missing_reps_and_weights(lyfter, session, write_sets, tmp_path):
+    write_sets([('2024-01-01', 'Back Squat', 40000, 40000, 100.0), ('2024-01-01', 'Back Squat', 1, None, None)])
+    lyfter['write_columnar_snapshot'](tmp_path, session=session)
+
+    workout_sets = lyfter['ColumnarSnapshot'](tmp_path).workout_sets
+    assert workout_sets['SetNumber'].tolist() == [40000, 1]
+    assert workout_sets['Reps'].tolist() == [40000, lyfter['WorkoutBatch'].missing_reps]
+    assert workout_sets['Weight'][0] == 100.0 and np.isnan(workout_sets['Weight'][1])
@@ -0,0 +1,35 @@
+import pytest
+
+
+def daily_muscle_sets(session):
+    return session.execute('SELECT UserID,MuscleID,Date,Sets,CumulativeSets FROM DailyMuscleSets '
+                           'ORDER BY UserID,MuscleID,Date;').fetchall()
+
+
+def assert_matches_rebuild(lyfter, session):
+    incremental = daily_muscle_sets(session)
+    lyfter['rebuild_volume_rollups'](session)
+    rebuilt = daily_muscle_sets(session)
+    assert [row[:3] for row in incremental] == [row[:3] for row in rebuilt]
+    for incremental_row, rebuilt_row in zip(incremental, rebuilt):
+        assert incremental_row[3:] == pytest.approx(rebuilt_row[3:])
+
+
+def test_multi_day_batch_counts_each_day_once(lyfter, session, write_sets):
+    write_sets([(date, 'Back Squat', 1, 5, 100.0) for date in ('2024-05-06', '2024-05-07', '2024-05-08')])
+
+    quadriceps_id = session.engine.muscle_ids[lyfter['muscle_names'].index('Quadriceps')]
+    cumulative_sets = [row[4] for row in daily_muscle_sets(session) if row[1] == quadriceps_id]
+    assert cumulative_sets == pytest.approx([1.0, 2.0, 3.0])
+    assert lyfter['get_rolling_muscle_sets']('2024-05-08', 7, session)['Quadriceps'] == pytest.approx(3.0)
+    assert_matches_rebuild(lyfter, session)
+
+
+def test_back_filled_and_deleted_days_match_rebuild(lyfter, session, write_sets):
+    write_sets([('2024-05-13', 'Back Squat', 1, 5, 100.0), ('2024-05-15', 'Deadlift', 1, 3, 140.0)])
+    write_sets([('2024-05-06', 'Back Squat', 1, 5, 100.0), ('2024-05-06', 'Back Squat', 2, 5, 100.0),
+                ('2024-05-09', 'Deadlift', 1, 3, 140.0), ('2024-05-14', 'Back Squat', 1, 5, 100.0)])
+    lyfter['delete_workout_sets']('2024-05-09', session=session)
+    lyfter['delete_workout_sets']('2024-05-06', 'Back Squat', 2, session=session)
+
+    assert_matches_rebuild(lyfter, session)
@@ -0,0 +1,33 @@
+import json
+
+import pytest
+
+
+@pytest.mark.parametrize('file_name', ['history.ndjson', 'history.csv'])
+def test_export_and_import_round_trip_sets_without_reps_or_weight(lyfter, session, write_sets, tmp_path, file_name):
+    sets = [('2024-05-06', 'Back Squat', 1, None, None), ('2024-05-06', 'Back Squat', 2, 5, 100.0)]
+    write_sets(sets)
+    path = str(tmp_path / file_name)
+    lyfter['export_workout_history'](path, session=session)
+
+    imported_session = lyfter['LyfterSession'](':memory:')
+    lyfter['create_lyfter_tables'](imported_session)
+    stats = lyfter['import_workout_history'](path, session=imported_session)
+
+    assert stats['rows'] == 2
+    assert imported_session.execute('SELECT Date,SetNumber,Reps,Weight FROM WorkoutTable ORDER BY SetNumber;'
+                                    ).fetchall() == [('2024-05-06', 1, None, None), ('2024-05-06', 2, 5, 100.0)]
+    imported_session.close()
+
+
+def test_skip_invalid_skips_out_of_range_records(lyfter, session, tmp_path):
+    path = tmp_path / 'history.ndjson'
+    records = [{'date': '2024-05-06', 'exercise': 'Back Squat', 'set_number': 1, 'reps': -1, 'weight': 100.0},
+               {'date': '2024-05-06', 'exercise': 'Back Squat', 'set_number': 2, 'reps': 5, 'weight': 100.0}]
+    path.write_text(''.join(json.dumps(record) + '\n' for record in records))
+
+    stats = lyfter['import_workout_history'](str(path), skip_invalid=True, session=session)
+
+    assert (stats['rows'], stats['skipped']) == (1, 1)
+    with pytest.raises(ValueError, match='Record 1: Reps'):
+        lyfter['import_workout_history'](str(path), restart=True, session=session)
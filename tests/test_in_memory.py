@@ -0,0 +1,65 @@
+import sqlite3
+
+import pytest
+
+
+def write_set(lyfter, session, date):
+    batch = lyfter['WorkoutBatch'](session.engine)
+    batch.append(date, 'Back Squat', 1, 5, 100.0)
+    lyfter['write_workout_batch'](batch, session)
+
+
+def stored_dates(database_path):
+    connection = sqlite3.connect(database_path)
+    dates = [row[0] for row in connection.execute('SELECT Date FROM WorkoutTable ORDER BY Date;')]
+    connection.close()
+    return dates
+
+
+@pytest.fixture
+def database_path(lyfter, tmp_path):
+    path = str(tmp_path / 'lyfter.db')
+    session = lyfter['LyfterSession'](path)
+    lyfter['create_lyfter_tables'](session)
+    write_set(lyfter, session, '2024-05-06')
+    session.close()
+    return path
+
+
+def test_file_is_unchanged_until_write_back_or_close(lyfter, database_path):
+    session = lyfter['LyfterSession'].in_memory(database_path)
+    write_set(lyfter, session, '2024-05-07')
+    assert stored_dates(database_path) == ['2024-05-06']
+
+    session.write_back()
+    assert stored_dates(database_path) == ['2024-05-06', '2024-05-07']
+
+    write_set(lyfter, session, '2024-05-08')
+    assert stored_dates(database_path) == ['2024-05-06', '2024-05-07']
+    session.close()
+    assert stored_dates(database_path) == ['2024-05-06', '2024-05-07', '2024-05-08']
+
+
+def test_commits_write_back_after_write_back_seconds(lyfter, database_path):
+    session = lyfter['LyfterSession'].in_memory(database_path, write_back_seconds=3600)
+    write_set(lyfter, session, '2024-05-07')
+    assert stored_dates(database_path) == ['2024-05-06']
+
+    session.write_back_seconds = 0
+    write_set(lyfter, session, '2024-05-08')
+    assert stored_dates(database_path) == ['2024-05-06', '2024-05-07', '2024-05-08']
+    session.close()
+
+
+def test_in_memory_pooled_session_replaces_the_file_when_closed(lyfter, database_path):
+    session = lyfter['use_in_memory_database'](database_path)
+    assert lyfter['get_session'](database_path) is session
+    write_set(lyfter, session, '2024-05-07')
+
+    # Writes made to the file by another connection meanwhile are overwritten by the write-back.
+    other_session = lyfter['LyfterSession'](database_path)
+    write_set(lyfter, other_session, '2024-05-09')
+    other_session.close()
+    lyfter['close_sessions']()
+
+    assert stored_dates(database_path) == ['2024-05-06', '2024-05-07']
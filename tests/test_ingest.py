@@ -0,0 +1,102 @@
+import json
+
+import pytest
+
+WORKOUT = [('2024-05-06', 'Back Squat', 1, 5, 100.0), ('2024-05-06', 'Back Squat', 2, 5, 100.0),
+           ('2024-05-06', 'Deadlift', 1, 3, 140.0)]
+
+
+def ingest(lyfter, session, sets, replace=True):
+    batch = lyfter['WorkoutBatch'](session.engine)
+    for workout_set in sets:
+        batch.append(*workout_set)
+    return lyfter['ingest_workout_batch'](batch, replace=replace, session=session)
+
+
+def stored_sets(session):
+    return session.execute('SELECT Date,ExerciseID,SetNumber,Reps,Weight FROM WorkoutTable ORDER BY 1,2,3;').fetchall()
+
+
+def weekly_quadriceps(session):
+    return session.execute('SELECT Quadriceps FROM WeeklyMuscleSets WHERE IsoYear=2024 AND WeekID=19;').fetchone()[0]
+
+
+def test_resubmitting_an_unchanged_workout_writes_nothing(lyfter, session):
+    ingest(lyfter, session, WORKOUT)
+    changes = session.conn.total_changes
+
+    stats = ingest(lyfter, session, list(reversed(WORKOUT)))
+
+    assert stats['workouts_skipped'] == 1 and stats['workouts_changed'] == 0
+    assert session.conn.total_changes == changes
+
+
+def test_changed_workout_only_applies_the_difference(lyfter, session):
+    ingest(lyfter, session, WORKOUT)
+    quadriceps = weekly_quadriceps(session)
+
+    stats = ingest(lyfter, session, [('2024-05-06', 'Back Squat', 1, 8, 100.0), WORKOUT[1],
+                                     ('2024-05-06', 'Back Squat', 3, 5, 100.0)])
+
+    assert (stats['sets_inserted'], stats['sets_updated'], stats['sets_deleted']) == (1, 1, 1)
+    assert [row[2:] for row in stored_sets(session)] == [(1, 8, 100.0), (2, 5, 100.0), (3, 5, 100.0)]
+    assert weekly_quadriceps(session) != quadriceps
+    weekly = session.execute('SELECT * FROM WeeklyMuscleSets;').fetchall()
+    volume = session.execute('SELECT * FROM WeeklyExerciseVolume ORDER BY 1,2,3,4;').fetchall()
+    lyfter['update_all_weekly_muscle_sets_in_sql'](session)
+    lyfter['rebuild_volume_rollups'](session)
+    assert session.execute('SELECT * FROM WeeklyMuscleSets;').fetchall() == [pytest.approx(row) for row in weekly]
+    assert session.execute('SELECT * FROM WeeklyExerciseVolume ORDER BY 1,2,3,4;').fetchall() == volume
+
+
+def test_ingest_without_replace_keeps_the_other_sets_of_the_workout(lyfter, session):
+    ingest(lyfter, session, WORKOUT)
+
+    stats = ingest(lyfter, session, [('2024-05-06', 'Back Squat', 2, 6, 100.0)], replace=False)
+
+    assert (stats['sets_inserted'], stats['sets_updated'], stats['sets_deleted']) == (0, 1, 0)
+    assert [row[2:] for row in stored_sets(session)] == [(1, 5, 100.0), (2, 6, 100.0), (1, 3, 140.0)]
+    # The stored hash covers the whole workout, so submitting it in full again is a no-op.
+    updated_workout = [WORKOUT[0], ('2024-05-06', 'Back Squat', 2, 6, 100.0), WORKOUT[2]]
+    assert ingest(lyfter, session, updated_workout)['workouts_skipped'] == 1
+
+
+def test_interactive_insert_adds_to_the_stored_workout(lyfter, session, monkeypatch):
+    ingest(lyfter, session, WORKOUT)
+    monkeypatch.setitem(lyfter['insert_new_workout_into_sql'].__globals__, 'create_workout_data',
+                        lambda: {'2024-05-06': {'Barbell Bench Press': {1: {'reps': 5, 'weight': 80.0}}}})
+
+    lyfter['insert_new_workout_into_sql'](session)
+
+    assert len(stored_sets(session)) == len(WORKOUT) + 1
+
+
+def test_reimporting_a_workout_spanning_two_chunks_changes_nothing(lyfter, session, tmp_path):
+    path = tmp_path / 'history.ndjson'
+    records = [{'date': date, 'exercise': exercise, 'set_number': set_number, 'reps': reps, 'weight': weight}
+               for date, exercise, set_number, reps, weight in WORKOUT]
+    path.write_text(''.join(json.dumps(record) + '\n' for record in records))
+
+    lyfter['import_workout_history'](str(path), chunk_size=2, session=session)
+    imported = stored_sets(session)
+    weekly = session.execute('SELECT * FROM WeeklyMuscleSets;').fetchall()
+    lyfter['import_workout_history'](str(path), chunk_size=2, restart=True, session=session)
+
+    assert len(imported) == len(WORKOUT)
+    assert stored_sets(session) == imported
+    assert session.execute('SELECT * FROM WeeklyMuscleSets;').fetchall() == weekly
+
+
+def test_unique_sets_migration_renumbers_duplicates(lyfter, session):
+    session.execute('DROP TABLE WorkoutHash;')
+    session.execute('DROP INDEX WorkoutTableDateIndex;')
+    session.execute('CREATE INDEX WorkoutTableDateIndex ON WorkoutTable (UserID, Date, ExerciseID, SetNumber);')
+    insert = lyfter['insert_workout_set_statement']
+    rows = [(1, '2024-05-06', 1, set_number, reps, 100.0, 2024, 19)
+            for set_number, reps in ((1, 5), (2, 5), (3, 5), (1, 6), (2, 7))]
+    session.executemany(insert, rows)
+
+    lyfter['migrate_to_unique_workout_sets'](session)
+
+    assert session.execute('SELECT SetNumber,Reps FROM WorkoutTable ORDER BY SetNumber;').fetchall() == [
+        (1, 5), (2, 5), (3, 5), (4, 6), (5, 7)]
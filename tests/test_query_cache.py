@@ -0,0 +1,46 @@
+import pytest
+
+
+def write_sets(lyfter, session, sets):
+    batch = lyfter['WorkoutBatch'](session.engine)
+    for workout_set in sets:
+        batch.append(*workout_set)
+    lyfter['write_workout_batch'](batch, session)
+
+
+@pytest.fixture
+def database_path(lyfter, tmp_path):
+    path = str(tmp_path / 'lyfter.db')
+    session = lyfter['LyfterSession'](path)
+    lyfter['create_lyfter_tables'](session)
+    session.close()
+    return path
+
+
+def test_writes_from_another_session_invalidate_the_cache(lyfter, database_path):
+    reader = lyfter['LyfterSession'](database_path)
+    writer = lyfter['LyfterSession'](database_path)
+    write_sets(lyfter, writer, [('2024-05-06', 'Back Squat', 1, 5, 100.0)])
+    assert len(lyfter['lookup_workout_sets']('2024-05-06', session=reader)) == 1
+
+    write_sets(lyfter, writer, [('2024-05-06', 'Back Squat', 2, 5, 100.0)])
+    lyfter['update_workout_set']('2024-05-06', 'Back Squat', 1, reps=8, session=writer)
+
+    assert [row[3] for row in lyfter['lookup_workout_sets']('2024-05-06', session=reader)] == [8, 5]
+    assert reader.query_cache.stats()['hits'] == 0
+    reader.close()
+    writer.close()
+
+
+def test_own_writes_only_invalidate_the_weeks_they_touch(lyfter, session, write_sets):
+    write_sets([('2024-05-06', 'Back Squat', 1, 5, 100.0), ('2024-05-13', 'Back Squat', 1, 5, 100.0)])
+    get_week = lyfter['get_weekly_muscle_sets_from_sql_workout_table']
+    get_week(19, 2024, session)
+    get_week(20, 2024, session)
+
+    write_sets([('2024-05-07', 'Deadlift', 1, 3, 140.0)])
+
+    assert len(get_week(19, 2024, session)) == 2
+    assert len(get_week(20, 2024, session)) == 1
+    stats = session.query_cache.stats()
+    assert (stats['hits'], stats['invalidations']) == (1, 1)
@@ -0,0 +1,81 @@
+import asyncio
+import json
+import sqlite3
+from pathlib import Path
+
+
+def workout_records(date, exercise, sets):
+    return [{'date': date, 'exercise': exercise, 'set_number': set_number, 'reps': 5, 'weight': 100.0}
+            for set_number in range(1, sets + 1)]
+
+
+async def send(socket_path, requests):
+    reader, writer = await asyncio.open_unix_connection(socket_path)
+    responses = []
+    for request in requests:
+        writer.write(json.dumps(request).encode() + b'\n')
+        await writer.drain()
+        responses.append(json.loads(await reader.readline()))
+    writer.close()
+    await writer.wait_closed()
+    return responses
+
+
+def client_requests(user_id):
+    return [{'id': 1, 'op': 'log', 'user_id': user_id, 'sets': workout_records('2024-05-06', 'Back Squat', 3)},
+            {'id': 2, 'op': 'read', 'user_id': user_id, 'date': '2024-05-06'},
+            {'id': 3, 'op': 'ingest', 'user_id': user_id, 'sets': workout_records('2024-05-07', 'Deadlift', 2)},
+            {'id': 4, 'op': 'ingest', 'user_id': user_id, 'sets': workout_records('2024-05-07', 'Deadlift', 2)},
+            {'id': 5, 'op': 'read', 'user_id': user_id, 'exercise': 'Deadlift'}]
+
+
+async def run_clients(lyfter, database_path, socket_path, clients):
+    service = lyfter['LyfterService'](database_path, reader_threads=2, commit_window=0.05)
+    await service.start()
+    server = await asyncio.start_unix_server(service.handle_client, path=socket_path)
+    try:
+        # The failing log is sent together with the first log of every client, so it is committed in their batch.
+        failing = [{'id': 1, 'op': 'log', 'user_id': 1, 'sets': workout_records('2024-05-08', 'Back Squats', 1)}]
+        responses = await asyncio.gather(send(socket_path, failing),
+                                         *(send(socket_path, client_requests(user_id))
+                                           for user_id in range(1, clients + 1)))
+    finally:
+        server.close()
+        await server.wait_closed()
+        await service.stop()
+    return service, responses
+
+
+def test_service_serves_concurrent_clients_and_isolates_failing_requests(lyfter, tmp_path):
+    database_path = str(tmp_path / 'lyfter.db')
+    clients = 8
+    service, (failed, *responses) = asyncio.run(run_clients(lyfter, database_path, str(tmp_path / 'lyfter.sock'),
+                                                            clients))
+
+    assert failed[0]['ok'] is False and 'Back Squats' in failed[0]['error']
+    for user_responses in responses:
+        assert all(response['ok'] for response in user_responses)
+        logged, workout, ingested, resubmitted, deadlifts = (response['result'] for response in user_responses)
+        assert logged == 3 and len(workout) == 3 and len(deadlifts) == 2
+        assert ingested['sets_inserted'] == 2 and resubmitted['workouts_skipped'] == 1
+    assert service.commits < clients*3
+
+    # Every connection was closed, so SQLite removed the WAL file when the last one closed.
+    assert not Path(database_path + '-wal').exists()
+    connection = sqlite3.connect(database_path)
+    assert connection.execute('SELECT UserID,COUNT(*) FROM WorkoutTable GROUP BY UserID;').fetchall() == [
+        (user_id, 5) for user_id in range(1, clients + 1)]
+    connection.close()
+
+
+def test_read_only_sessions_open_databases_that_are_not_in_wal_mode(lyfter, tmp_path):
+    database_path = str(tmp_path / 'lyfter.db')
+    session = lyfter['LyfterSession'](database_path, pragmas={})
+    lyfter['create_lyfter_tables'](session)
+    session.close()
+
+    read_only_session = lyfter['LyfterSession'](database_path, read_only=True)
+
+    assert read_only_session.execute('PRAGMA journal_mode;').fetchone()[0] == 'delete'
+    assert read_only_session.execute('SELECT COUNT(*) FROM WorkoutTable;').fetchone()[0] == 0
+    read_only_session.close()
@@ -0,0 +1,57 @@
+import pytest
+
+WEEK = (1, 2024, 20)
+
+
+def write_weeks(write_sets):
+    write_sets([(date, exercise, set_number, 5, 100.0)
+                for date in ('2024-05-06', '2024-05-13', '2024-05-20') for exercise in ('Back Squat', 'Deadlift')
+                for set_number in (1, 2)])
+
+
+def drift_week(lyfter, session):
+    # A set added and two deleted straight in WorkoutTable, and a corrupted WeeklyMuscleSets column, all in
+    # week 20; the corrupted column of week 21 is not noticed as the sets of week 21 did not change.
+    session.execute(lyfter['insert_workout_set_statement'],
+                    (1, '2024-05-14', session.engine.exercise_ids['Barbell Bench Press'], 1, 5, 80.0, 2024, 20))
+    session.execute("DELETE FROM WorkoutTable WHERE Date='2024-05-13' AND SetNumber=2;")
+    session.execute('UPDATE WeeklyMuscleSets SET Quadriceps = 99 WHERE WeekID IN (20, 21);')
+
+
+def fingerprinted_weeks(session):
+    return session.execute('SELECT UserID,IsoYear,IsoWeek FROM WeekFingerprint ORDER BY 1,2,3;').fetchall()
+
+
+def test_only_weeks_whose_sets_changed_are_checked_and_repaired(lyfter, session, write_sets):
+    write_weeks(write_sets)
+    verify = lyfter['verify_weekly_muscle_sets']
+    assert verify(session=session)['weeks_checked'] == 3
+    drift_week(lyfter, session)
+
+    report = verify(session=session)
+
+    assert report['weeks_checked'] == 1
+    assert [(week['user_id'], week['iso_year'], week['iso_week']) for week in report['drifted_weeks']] == [WEEK]
+    assert {'Quadriceps', 'Pectorals'} <= report['drifted_weeks'][0]['muscles'].keys()
+    weekly = session.execute('SELECT WeekID,Quadriceps FROM WeeklyMuscleSets ORDER BY WeekID;').fetchall()
+    lyfter['update_all_weekly_muscle_sets_in_sql'](session)
+    rebuilt = session.execute('SELECT WeekID,Quadriceps FROM WeeklyMuscleSets ORDER BY WeekID;').fetchall()
+    assert weekly[:2] == [pytest.approx(row) for row in rebuilt[:2]]
+    assert weekly[2] == (21, 99.0)
+    assert verify(session=session)['weeks_checked'] == 0
+
+
+def test_unrepaired_weeks_stay_unfingerprinted_until_repaired(lyfter, session, write_sets):
+    write_weeks(write_sets)
+    verify = lyfter['verify_weekly_muscle_sets']
+    verify(session=session)
+    drift_week(lyfter, session)
+
+    report = verify(repair=False, session=session)
+
+    assert report['weeks_checked'] == 1 and not report['repaired']
+    assert session.execute('SELECT Quadriceps FROM WeeklyMuscleSets WHERE WeekID=20;').fetchone()[0] == 99.0
+    assert WEEK not in fingerprinted_weeks(session)
+    assert verify(repair=False, session=session)['weeks_checked'] == 1
+    assert len(verify(session=session)['drifted_weeks']) == 1
+    assert WEEK in fingerprinted_weeks(session)
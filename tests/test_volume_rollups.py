@@ -0,0 +1,29 @@
+import random
+
+import pytest
+
+ROLLUP_TABLES = ('DailyExerciseVolume', 'WeeklyExerciseVolume', 'DailyMuscleVolume', 'WeeklyMuscleVolume')
+
+
+def rollups(session):
+    return {table: session.execute(f'SELECT * FROM {table} ORDER BY 1,2,3,4;').fetchall() for table in ROLLUP_TABLES}
+
+
+def test_incremental_rollups_match_rebuild_after_updates_and_deletes(lyfter, session, write_sets):
+    rng = random.Random(0)
+    exercises = ['Back Squat', 'Deadlift', 'Barbell Bench Press']
+    sets = [(f'2024-05-{day:02d}', exercise, set_number, rng.randint(1, 10), rng.choice([60.0, 80.0, 100.0]))
+            for day in range(1, 22) for exercise in rng.sample(exercises, 2) for set_number in (1, 2)]
+    write_sets(sets)
+    for date, exercise, set_number, reps, weight in rng.sample(sets, 20):
+        lyfter['update_workout_set'](date, exercise, set_number, reps=rng.randint(1, 10), session=session)
+    for date, exercise, set_number, reps, weight in rng.sample(sets, 30):
+        lyfter['delete_workout_sets'](date, exercise, set_number, session=session)
+    lyfter['delete_workout_sets']('2024-05-10', session=session)
+
+    incremental = rollups(session)
+    lyfter['rebuild_volume_rollups'](session)
+    rebuilt = rollups(session)
+    for table in ROLLUP_TABLES:
+        assert [row[:-1] for row in incremental[table]] == [row[:-1] for row in rebuilt[table]]
+        assert [row[-1] for row in incremental[table]] == pytest.approx([row[-1] for row in rebuilt[table]])
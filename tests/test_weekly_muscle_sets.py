@@ -0,0 +1,53 @@
+import random
+
+import pytest
+
+
+def test_interactive_delete_returns_the_iso_year_and_week(lyfter, session, write_sets, monkeypatch):
+    write_sets([('2021-01-02', 'Back Squat', 1, 5, 100.0), ('2021-01-02', 'Back Squat', 2, 5, 100.0)])
+    answers = iter(['set', '2021-01-02', 'Back Squat', '2'])
+    monkeypatch.setattr('builtins.input', lambda prompt='': next(answers))
+
+    # 2021-01-02 falls in week 53 of ISO year 2020.
+    assert lyfter['delete'](session) == (2020, 53)
+
+
+def test_refreshing_a_past_week_writes_that_year(lyfter, session, write_sets):
+    write_sets([('2021-01-02', 'Back Squat', 1, 5, 100.0)])
+    session.execute('UPDATE WeeklyMuscleSets SET Quadriceps = 0;')
+
+    lyfter['specific_weekly_muscle_sets_update_sql'](53, 2020, session)
+
+    assert session.execute('SELECT IsoYear,WeekID,Quadriceps FROM WeeklyMuscleSets;').fetchall() == [
+        (2020, 53, pytest.approx(1.0))]
+    with pytest.raises(TypeError):
+        lyfter['specific_weekly_muscle_sets_update_sql'](53)
+
+
+def weekly_muscle_sets(session):
+    return session.execute('SELECT * FROM WeeklyMuscleSets ORDER BY UserID,IsoYear,WeekID;').fetchall()
+
+
+def test_incremental_weekly_muscle_sets_match_both_rebuilds(lyfter, session, write_sets):
+    rng = random.Random(1)
+    exercises = ['Back Squat', 'Deadlift', 'Barbell Bench Press', 'Pull Ups']
+    sets = [(f'2024-{month:02d}-{day:02d}', exercise, set_number, rng.randint(1, 10), 100.0)
+            for month in (5, 6) for day in range(1, 29, 2) for exercise in rng.sample(exercises, 2)
+            for set_number in (1, 2, 3)]
+    write_sets(sets)
+    for date, exercise, set_number, reps, weight in rng.sample(sets, 30):
+        lyfter['update_workout_set'](date, exercise, set_number, reps=rng.randint(1, 10), session=session)
+    for date, exercise, set_number, reps, weight in rng.sample(sets, 40):
+        lyfter['delete_workout_sets'](date, exercise, set_number, session=session)
+    lyfter['delete_workout_sets']('2024-06-03', session=session)
+    write_sets([('2024-07-01', 'Back Squat', 1, 5, 100.0)])
+
+    incremental = weekly_muscle_sets(session)
+    lyfter['rebuild_weekly_muscle_sets_in_sql'](session)
+    rebuilt_in_sql = weekly_muscle_sets(session)
+    lyfter['update_all_weekly_muscle_sets_in_sql'](session, aggregate_in_sql=False)
+    rebuilt_in_python = weekly_muscle_sets(session)
+
+    for rebuilt in (rebuilt_in_sql, rebuilt_in_python):
+        assert [row[:3] for row in rebuilt] == [row[:3] for row in incremental]
+        assert [row[3:] for row in rebuilt] == [pytest.approx(row[3:]) for row in incremental]
@@ -0,0 +1,42 @@
+import pytest
+
+
+def test_sets_without_reps_or_weight_are_stored_as_null(lyfter, session, write_sets):
+    write_sets([('2024-05-06', 'Back Squat', 1, None, 100.0), ('2024-05-06', 'Back Squat', 2, 5, None),
+                ('2024-05-06', 'Back Squat', 3, 5, 100.0)])
+
+    assert session.execute('SELECT SetNumber,Reps,Weight FROM WorkoutTable ORDER BY SetNumber;').fetchall() == [
+        (1, None, 100.0), (2, 5, None), (3, 5, 100.0)]
+    assert lyfter['get_exercise_progress']('Back Squat', session=session) == [
+        ('2024-05-06', 3, 500.0, pytest.approx(100.0*(1 + 5/30)))]
+
+
+def test_workout_changes_ignore_incomplete_sets(lyfter, session):
+    batch = lyfter['WorkoutBatch'](session.engine)
+    batch.append('2024-05-06', 'Back Squat', 1, None, None)
+    assert batch.workout_changes() == [('2024-05-06', session.engine.exercise_ids['Back Squat'], 1, 0.0, None)]
+
+
+@pytest.mark.parametrize('set_number,reps,weight', [(1, -1, 100.0), (1, 70000, 100.0), (-1, 5, 100.0),
+                                                    (1, 5, float('nan'))])
+def test_out_of_range_sets_raise_value_error(lyfter, session, set_number, reps, weight):
+    with pytest.raises(ValueError):
+        lyfter['WorkoutBatch'](session.engine).append('2024-05-06', 'Back Squat', set_number, reps, weight)
+
+
+def test_exercises_added_to_the_catalog_are_accepted_by_default(lyfter, tmp_path):
+    database_path = lyfter['get_session'].__globals__['DATABASE_PATH']
+    lyfter['set_database_path'](str(tmp_path / 'lyfter.db'))
+    try:
+        lyfter['create_lyfter_tables']()
+        lyfter['add_exercise']('Hack Squat', {'Quadriceps': 1, 'Glutes': 2})
+
+        batch = lyfter['WorkoutBatch']()
+        batch.append('2024-05-06', 'Hack Squat', 1, 8, 120.0)
+        record = {'date': '2024-05-06', 'exercise': 'Hack Squat', 'set_number': 2, 'reps': 8, 'weight': 120.0}
+        assert lyfter['parse_workout_record'](record) == ('2024-05-06', 'Hack Squat', 2, 8, 120.0)
+        lyfter['write_workout_batch'](batch)
+        assert lyfter['lookup_workout_sets'](exercise='Hack Squat')[0][1:] == ('Hack Squat', 1, 8, 120.0)
+    finally:
+        lyfter['close_sessions']()
+        lyfter['set_database_path'](database_path)